@@ -1,10 +1,33 @@
 #!/usr/bin/python
+import argparse
 import web_interface
 import i2c_raspberry
 
 if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='HPLED-Control System')
+	parser.add_argument('buses', metavar='BUS', type=int, nargs='*',
+			help='numbers of the I2C buses the controllers are connected to')
+	parser.add_argument('--simulate', metavar='N', type=int, default=0,
+			help='simulate N controllers instead of using the I2C hardware')
+	parser.add_argument('--fps', type=float, default=i2c_raspberry.FRAME_RATE,
+			help='rate at which changes are written to the controllers')
+	parser.add_argument('--gamma', type=float, default=i2c_raspberry.GAMMA,
+			help='gamma correction of the LED colors')
+	parser.add_argument('--dither', action='store_true',
+			help='dither the LED colors over several frames for smoother fades')
+	parser.add_argument('--store-delay', type=float, default=i2c_raspberry.STORE_DELAY,
+			help='delay (seconds) after which changed LED-Sets are stored')
+	parser.add_argument('--journal', action='store_true',
+			help='store changed LED-Sets in a journal that is compacted periodically')
+	args = parser.parse_args()
+	buses = args.buses
+	if args.simulate:
+		from i2c_raspberry import i2c_sim
+		buses = sorted(i2c_sim.install(i2c_sim.fleet(args.simulate)).keys())
+
 	# create seperate threads for front and backend
-	back = i2c_raspberry.RgbCoordinator()
+	back = i2c_raspberry.RgbCoordinator(buses, args.fps, args.gamma, args.dither,
+			args.store_delay, args.journal)
 	front = web_interface.Frontend(back)
 	front.start();
 	
@@ -13,4 +36,5 @@ if __name__ == '__main__':
 	threads.append(front)
 	for t in threads:
 		t.join()
+	back.stop()
 	print("exiting main thread")
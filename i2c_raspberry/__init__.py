@@ -1,4 +1,10 @@
 # use this import line when working on a Raspberry
 from i2c_raspberry import RgbCoordinator, RgbController, RgbLed, RgbLedSet, HttpError
+from render import FRAME_RATE
+from color import GAMMA
+from storage import STORE_DELAY
+from effects import get_effects
 # use this import line when working on a normal machine to simulate I2C
+# (or keep the line above and simulate the bus with i2c_sim.install(), see
+# coordinator.py --simulate)
 #from i2c_mock import RgbCoordinator, RgbController, RgbLed, RgbLedSet, HttpError
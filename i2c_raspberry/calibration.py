@@ -0,0 +1,162 @@
+#!/usr/bin/python
+import io
+import os
+import json
+import bisect
+
+from color import calibration_matrix
+
+# the current limit of an LED driver IC is set by its external resistor R_ext,
+# read as: (Output current, External Resistor value), taken from the
+# STP04CM05 datasheet fig. 13
+CURRENT_CURVE = [ (50, 1550),
+		(80, 950),
+		(100, 800),
+		(150, 500),
+		(350, 220),
+		(400, 200),
+		(500, 180) ]
+# wiper and end-to-end resistance of the digital resistor (AD5204) in Ohm
+R_WIPER = 45
+R_AB = 10000
+
+CALIBRATION_FILE = 'calibration.json'
+
+# interpolates the resistor value for the R_ext input of an LED driver IC
+# based on the given curve (list of (current, resistor value) points)
+# R_ext limits the current output of the IC.
+def interpolate_resistor_value(i_led, table=CURRENT_CURVE):
+	# return with min/max values if the requested current exceeds the range
+	# of the lut
+	if (i_led < table[0][0]):
+		return table[0][1]
+	elif(i_led > table[-1][0]):
+		return table[-1][1]
+
+	# current is in range of lut
+	for idx in range(len(table)-1):
+		# check the lut for the correct period
+		if (i_led >= table[idx][0] and i_led <= table[idx+1][0]):
+			# interpolate a linear function between the two points
+			delta_r_ext = (table[idx+1][1] - table[idx][1])
+			delta_i_out = (table[idx+1][0] - table[idx][0])
+			m = float(delta_r_ext) / delta_i_out
+			n = table[idx][1] - m * table[idx][0]
+			return int(m*i_led +n)
+
+# the digital resistor has a range of 10kOhm divided into 256 discrete steps.
+# It is used to set the current limit of the LED driver IC
+# The formula for calculating the input value is derived from the datasheet
+def calculate_digital_resistor_input(r_ext, r_wiper=R_WIPER, r_ab=R_AB):
+	# R_wa(D_x) = (256-D_x)/256 * R_ab + R_w => from digital input to Ohm
+	# D_x = (256 * (R_w+R_ab-R_wa)) / R_ab => from Ohm to digital input
+	d_x = int((256*(r_wiper+r_ab-r_ext))/r_ab)
+	return min(max(d_x, 0), 255)
+
+
+# The digital resistor input for every current limit (mA) of a calibration
+# curve, computed once, so the conversion in the frame path is an index into
+# the table. Current limits above the end of the curve use its last value.
+class CalibrationTable(object):
+	def __init__(self, curve=CURRENT_CURVE, r_wiper=R_WIPER, r_ab=R_AB):
+		curve = sorted((int(i), int(r)) for i, r in curve)
+		self.max_current = curve[-1][0]
+		self.table = bytearray(calculate_digital_resistor_input(
+				interpolate_resistor_value(i_led, curve), r_wiper, r_ab)
+				for i_led in range(self.max_current + 1))
+
+	def lookup(self, current_limit):
+		if current_limit > self.max_current:
+			return self.table[self.max_current]
+		if current_limit < 0:
+			return self.table[0]
+		return self.table[int(current_limit)]
+
+	# the lowest current limit (mA) whose digital resistor input is at least
+	# the given value, the input increases with the current limit
+	def current(self, value):
+		return min(bisect.bisect_left(self.table, value), self.max_current)
+
+
+# The calibration profiles of the installation. The boards differ in practice,
+# so the curve (and the digital resistor values) can be set in the
+# calibration file for all boards, per board (by controller address) and per
+# LED channel of a board:
+#
+# {"default": {"curve": [[50, 1550], ..., [500, 180]], "r_wiper": 45, "r_ab": 10000},
+#  "boards": {"33": {"curve": [...], "channels": {"2": {"curve": [...]}}}}}
+#
+# The profiles also hold the color calibration of the LEDs: "matrix", a 4x4
+# matrix that mixes the (r, g1, g2, b) channels, and "white", the gains of
+# the channels for the white point (see ColorCalibration).
+#
+# Unset values are inherited from the enclosing profile. Every distinct
+# profile is compiled into a CalibrationTable once.
+class Calibration(object):
+	def __init__(self, profiles=None):
+		self.profiles = profiles if profiles is not None else {}
+		self.tables = {}
+
+	@classmethod
+	def load(cls, path=CALIBRATION_FILE):
+		if not os.path.exists(path):
+			return cls()
+		with io.open(path, 'r', encoding='utf-8') as calibration_file:
+			try:
+				calibration = cls(json.loads(calibration_file.read()))
+				calibration.verify()
+				return calibration
+			except (ValueError, TypeError, IndexError, KeyError, AttributeError) as e:
+				print(e, "Calibration file corrupted, using the datasheet values")
+				return cls()
+
+	# compile the table and the color matrix of every profile, raises if a
+	# profile is invalid, so a broken file is found when it is loaded and not
+	# when a controller is found
+	def verify(self):
+		if not isinstance(self.profiles, dict):
+			raise ValueError('the calibration has to be an object')
+		boards = self.profiles.get('boards', {})
+		if not isinstance(self.profiles.get('default', {}), dict) or not isinstance(boards, dict):
+			raise ValueError('the default profile and the boards have to be objects')
+		profiles = [(None, None)]
+		for addr, board in boards.items():
+			if not isinstance(board, dict) or not isinstance(board.get('channels', {}), dict):
+				raise ValueError('the profile of board %s has to be an object' % addr)
+			profiles.append((addr, None))
+			for channel, profile in board.get('channels', {}).items():
+				if not isinstance(profile, dict):
+					raise ValueError('the profile of channel %s of board %s has to be an object'
+							% (channel, addr))
+				profiles.append((addr, channel))
+		for addr, channel in profiles:
+			if not len(self.table(addr, channel).table):
+				raise ValueError('the curve of board %s ends below 0 mA' % addr)
+			calibration_matrix(*self.color(addr, channel))
+
+	# the merged profile of an LED channel of a board
+	def profile(self, addr, channel):
+		profile = {'curve': CURRENT_CURVE, 'r_wiper': R_WIPER, 'r_ab': R_AB}
+		profile.update(self.profiles.get('default', {}))
+		board = self.profiles.get('boards', {}).get(str(addr), {})
+		profile.update(board)
+		profile.update(board.get('channels', {}).get(str(channel), {}))
+		return profile
+
+	# the compiled table of an LED channel of a board
+	def table(self, addr, channel):
+		profile = self.profile(addr, channel)
+		key = (tuple(tuple(point) for point in profile['curve']),
+				profile['r_wiper'], profile['r_ab'])
+		if key not in self.tables:
+			self.tables[key] = CalibrationTable(*key)
+		return self.tables[key]
+
+	# the color matrix and white point of an LED channel of a board, None if
+	# not set
+	def color(self, addr, channel):
+		profile = self.profile(addr, channel)
+		return profile.get('matrix'), profile.get('white')
+
+
+default_table = CalibrationTable()
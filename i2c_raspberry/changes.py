@@ -0,0 +1,56 @@
+#!/usr/bin/python
+import threading
+import itertools
+import collections
+
+# number of change records kept, clients that fall further behind have to
+# fetch the complete state
+CHANGE_LOG_SIZE = 4096
+
+
+# The versions of the state of the installation and the resources that
+# changed with every version, kept in a ring buffer of (version, (kind, key))
+# records: kind is 'controller' (key: addr), 'led' (key: (addr, channel)) or
+# 'led_set' (key: name). A client that knows the state of version N fetches
+# the resources changed since; if records after N were dropped from the
+# buffer, or the log was reset, it has to fetch the complete state instead.
+class ChangeLog(object):
+	def __init__(self, size=CHANGE_LOG_SIZE):
+		self.records = collections.deque(maxlen=size)
+		self.lock = threading.Lock()
+		self.versions = itertools.count(1)
+		self.version = next(self.versions)
+		# the changes after this version are complete
+		self.complete_since = self.version
+
+	# start a new version, changes is a list of the changed (kind, key)
+	def record(self, changes=()):
+		with self.lock:
+			self.version = next(self.versions)
+			for change in changes:
+				if len(self.records) == self.records.maxlen:
+					self.complete_since = max(self.complete_since, self.records[0][0])
+				self.records.append((self.version, change))
+			return self.version
+
+	# start a new version that requires all clients to fetch the complete
+	# state, e.g. when a change can't be described by records
+	def reset(self):
+		with self.lock:
+			self.version = next(self.versions)
+			self.complete_since = self.version
+			self.records.clear()
+			return self.version
+
+	# the distinct (kind, key) changed after version since, in order of their
+	# last change, None if the changes are not complete
+	def since(self, since):
+		with self.lock:
+			if since < self.complete_since or since > self.version:
+				return None
+			changes = collections.OrderedDict()
+			for version, change in self.records:
+				if version > since:
+					changes.pop(change, None)
+					changes[change] = version
+			return list(changes)
@@ -0,0 +1,187 @@
+#!/usr/bin/python
+import math
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+# the soft PWM of the controller boards has 32 levels, the level of a
+# channel value v is v >> 3 (see PWM_LEVELS in rgb-pcb/rgb_pcb.ino)
+PWM_LEVELS = 32
+PWM_STEP = 256 // PWM_LEVELS
+GAMMA = 2.2
+# resolution of the table that encodes the linear channel values of the color
+# calibration back into channel values
+ENCODE_STEPS = 65536
+# the channels of an LED (r, g1, g2, b)
+IDENTITY = [[1.0, 0.0, 0.0, 0.0],
+		[0.0, 1.0, 0.0, 0.0],
+		[0.0, 0.0, 1.0, 0.0],
+		[0.0, 0.0, 0.0, 1.0]]
+WHITE_POINT = [1.0, 1.0, 1.0, 1.0]
+# number of frames a dithering cycle takes, every phase uses a different
+# threshold, so the average of the output levels over the cycle follows the
+# gamma corrected value with DITHER_PHASES times the PWM resolution
+DITHER_PHASES = 4
+DITHER_ORDER = [0, 2, 1, 3]
+
+
+# the channel value the firmware maps to a PWM level, the bits of the level
+# are repeated in the low bits so that the highest level is sent as 255
+def level_value(level):
+	return (level * PWM_STEP) | (level >> 2)
+
+
+# Converts the channel values of the LEDs (0-255, as set through the API) into
+# the values that are sent to the controller boards: the values are gamma
+# corrected and quantized to the PWM levels of the firmware. Values that end
+# up on the same level are sent as the same byte, so changes that aren't
+# visible on the LEDs don't cause bus writes.
+# With dithering the fractional part of a level is distributed over
+# DITHER_PHASES frames, which gives smoother fades at high frame rates, at the
+# cost of writes in every frame for channels between two levels.
+# The conversion is a lookup table per phase that is applied to a complete
+# color block with bytearray.translate().
+class ColorPipeline(object):
+	def __init__(self, gamma=GAMMA, levels=PWM_LEVELS, dithering=False):
+		self.gamma = gamma
+		self.levels = levels
+		self.dithering = dithering
+		self.frame = 0
+		if dithering:
+			thresholds = [(order + 0.5) / DITHER_PHASES for order in DITHER_ORDER]
+		else:
+			thresholds = [0.5]
+		self.tables = [self.compile(threshold) for threshold in thresholds]
+
+	def compile(self, threshold):
+		table = bytearray(256)
+		for value in range(256):
+			level = math.pow(value / 255.0, self.gamma) * (self.levels - 1)
+			level = min(int(math.floor(level + threshold)), self.levels - 1)
+			table[value] = level_value(level)
+		return table
+
+	# start the next frame, advances the dithering phase
+	def advance(self):
+		self.frame += 1
+
+	# the table for the current frame of a controller, the phases of the
+	# controllers are offset so that they don't toggle in sync
+	def table(self, addr=0):
+		return self.tables[(self.frame + addr) % len(self.tables)]
+
+	# convert a block of channel values into the values sent to the board
+	def convert(self, values, addr=0):
+		return values.translate(self.table(addr))
+
+
+
+default_pipeline = ColorPipeline()
+
+
+# the matrix of an LED with the white point gains applied to its rows, a white
+# point with three values (r, g, b) applies the green gain to both greens
+def calibration_matrix(matrix=None, white=None):
+	matrix = matrix if matrix is not None else IDENTITY
+	white = white if white is not None else WHITE_POINT
+	if len(white) == 3:
+		white = [white[0], white[1], white[1], white[2]]
+	if len(matrix) != 4 or len(white) != 4 or any(len(row) != 4 for row in matrix):
+		raise ValueError('the color calibration needs a 4x4 matrix and 4 white point gains')
+	return [[float(gain) * float(value) for value in row]
+			for gain, row in zip(white, matrix)]
+
+
+# Corrects the colors of the LEDs for the differences between the LEDs of the
+# installation: the channels of an LED are mixed with a 4x4 matrix in linear
+# light (decoded with the gamma of the pipeline) and scaled to the white point
+# of the LED, then encoded back into channel values for the color pipeline.
+# render() converts the colors of all controllers of the frame buffer into the
+# output buffer at once, with numpy as a single array operation over the
+# installation, without numpy only the LEDs that have a calibration are
+# computed and the others are copied.
+# LEDs are addressed by the block of their controller and their index, the
+# colors of a block are leds * channels bytes at its start.
+class ColorCalibration(object):
+	def __init__(self, frame, gamma=GAMMA, leds=4, channels=4):
+		self.frame = frame
+		self.gamma = gamma
+		self.leds = leds
+		self.channels = channels
+		self.output = bytearray(len(frame.buffer))
+		self.matrices = {}
+		self.array = None
+		self.array_mask = None
+		self.array_decode = None
+		self.array_encode = None
+		self.decode = [math.pow(value / 255.0, gamma) for value in range(256)]
+		self.encode = bytearray(int(math.pow(step / (ENCODE_STEPS - 1.0), 1 / gamma) * 255 + 0.5)
+				for step in range(ENCODE_STEPS))
+
+	# True if any LED has a calibration
+	@property
+	def active(self):
+		return bool(self.matrices)
+
+	# set the calibration of an LED, LEDs with the identity are only copied
+	def set_led(self, block, led, matrix=None, white=None):
+		matrix = calibration_matrix(matrix, white)
+		if matrix == IDENTITY:
+			self.matrices.pop((block, led), None)
+		else:
+			self.matrices[(block, led)] = matrix
+		self.array = None
+
+	# the calibrated colors of a block
+	def block(self, block):
+		offset = self.frame.offset(block)
+		return memoryview(self.output)[offset:offset+self.frame.block_size]
+
+	# calibrate the colors of the frame buffer into the output buffer
+	def render(self):
+		if numpy is not None:
+			self.render_array()
+		else:
+			self.render_leds()
+
+	def render_array(self):
+		blocks, block_size = self.frame.blocks, self.frame.block_size
+		size = self.leds * self.channels
+		if self.array is None:
+			self.compile_array()
+		frame = numpy.frombuffer(self.frame.buffer, numpy.uint8).reshape(blocks, block_size)
+		output = numpy.frombuffer(self.output, numpy.uint8).reshape(blocks, block_size)
+		colors = self.array_decode[frame[:, :size].reshape(blocks, self.leds, self.channels)]
+		colors = numpy.einsum('blij,blj->bli', self.array, colors)
+		steps = numpy.clip(colors, 0.0, 1.0) * (ENCODE_STEPS - 1) + 0.5
+		colors = self.array_encode[steps.astype(numpy.intp)]
+		original = frame[:, :size].reshape(blocks, self.leds, self.channels)
+		output[:, :size] = numpy.where(self.array_mask, colors, original).reshape(blocks, size)
+
+	# the matrices of all LEDs of the frame buffer as one array
+	def compile_array(self):
+		array = numpy.empty((self.frame.blocks, self.leds, self.channels, self.channels),
+				numpy.float32)
+		array[:] = IDENTITY
+		# LEDs without calibration keep their values exactly
+		mask = numpy.zeros((self.frame.blocks, self.leds, 1), bool)
+		for (block, led), matrix in list(self.matrices.items()):
+			array[block, led] = matrix
+			mask[block, led] = True
+		self.array_mask = mask
+		self.array_decode = numpy.array(self.decode, numpy.float32)
+		self.array_encode = numpy.frombuffer(self.encode, numpy.uint8)
+		self.array = array
+
+	def render_leds(self):
+		frame, output, encode = self.frame.buffer, self.output, self.encode
+		output[:] = frame
+		steps = ENCODE_STEPS - 1
+		for (block, led), matrix in list(self.matrices.items()):
+			offset = self.frame.offset(block) + led * self.channels
+			colors = [self.decode[value] for value in frame[offset:offset+self.channels]]
+			for channel, row in enumerate(matrix):
+				value = sum(weight * color for weight, color in zip(row, colors))
+				output[offset+channel] = encode[int(min(max(value, 0.0), 1.0) * steps + 0.5)]
@@ -0,0 +1,99 @@
+#!/usr/bin/python
+import threading
+
+import i2c as i2c
+from i2c_executor import PRIORITY_DISCOVERY
+
+# range of I2C addresses that is scanned for controllers
+SCAN_FIRST = 5
+SCAN_LAST = 126
+
+# Scans the I2C bus for controller boards in a background thread.
+# Each step probes only a few addresses and the thread sleeps between the
+# steps, so the scan never occupies the bus for long and frames are written in
+# between. The known controllers are checked in rotation, known_step per step:
+# a controller that misses lost_after consecutive probes is reported as lost,
+# a lost controller that answers again is reported as found. A controller for
+# which alive(addr) is True (e.g. because a frame was written to it recently)
+# counts as answered without a probe.
+# If an executor is given, the probes are submitted to it with low priority.
+class ControllerDiscovery(threading.Thread):
+	def __init__(self, found, lost, bus=None, executor=None, step=8,
+			interval=0.05, lost_after=3, known_step=4, alive=None):
+		super(ControllerDiscovery, self).__init__()
+		self.daemon = True
+		self.found = found
+		self.lost = lost
+		self.bus = bus if bus is not None else i2c.session()
+		self.executor = executor
+		self.step = step
+		self.interval = interval
+		self.lost_after = lost_after
+		self.known_step = known_step
+		self.alive = alive if alive is not None else lambda addr: False
+		self.known = set()
+		self.online = set()
+		self.misses = {}
+		self.next_addr = SCAN_FIRST
+		self.next_known = 0
+		self.lock = threading.Lock()
+		self.stopped = threading.Event()
+
+	def probe(self, addr):
+		try:
+			msg = i2c.writing_bytes(addr, 0x00)
+			if self.executor is None:
+				self.bus.transaction(msg)
+			else:
+				self.executor.submit(self.bus.transaction, msg,
+					priority=PRIORITY_DISCOVERY).result()
+			return True
+		except (IOError, OSError):
+			return False
+
+	# probe the next addresses of the scan range and check the next known
+	# controllers
+	def scan_step(self):
+		with self.lock:
+			addresses = set()
+			for _ in range(self.step):
+				addresses.add(self.next_addr)
+				self.next_addr += 1
+				if self.next_addr > SCAN_LAST:
+					self.next_addr = SCAN_FIRST
+			known = sorted(self.known)
+			for _ in range(min(self.known_step, len(known))):
+				self.next_known %= len(known)
+				addresses.add(known[self.next_known])
+				self.next_known += 1
+			for addr in sorted(addresses):
+				if addr in self.online and self.alive(addr):
+					self.check(addr, True)
+				else:
+					self.check(addr, self.probe(addr))
+
+	def check(self, addr, answered):
+		if answered:
+			self.misses[addr] = 0
+			if addr not in self.online:
+				self.known.add(addr)
+				self.online.add(addr)
+				self.found(addr)
+		elif addr in self.online:
+			self.misses[addr] = self.misses.get(addr, 0) + 1
+			if self.misses[addr] >= self.lost_after:
+				self.online.discard(addr)
+				self.lost(addr)
+
+	# scan the complete address range once (blocking)
+	def scan(self):
+		for _ in range((SCAN_LAST - SCAN_FIRST) // self.step + 1):
+			self.scan_step()
+
+	def run(self):
+		while not self.stopped.is_set():
+			self.scan_step()
+			self.stopped.wait(self.interval)
+
+	def stop(self):
+		self.stopped.set()
@@ -0,0 +1,184 @@
+#!/usr/bin/python
+import time
+import math
+import colorsys
+
+# Animations that are computed by the coordinator for all LEDs of an LED-Set
+# once per frame, so smooth animations don't need a request per frame.
+# render() returns the (r, g, b) colors of count LEDs at t seconds after the
+# start of the effect, the parameters are set when the effect is created and
+# listed with their defaults in the class.
+
+def channel(value):
+	return min(max(int(value), 0), 255)
+
+def rgb(color):
+	return (channel(color.get('r', 0)), channel(color.get('g', 0)),
+			channel(color.get('b', 0)))
+
+def scale(color, level):
+	return (int(color[0] * level), int(color[1] * level), int(color[2] * level))
+
+
+class Effect(object):
+	name = None
+	defaults = {}
+
+	def __init__(self, params=None):
+		self.params = dict(self.defaults)
+		if params:
+			self.params.update(params)
+		self.configure(**self.params)
+		self.start = time.time()
+
+	def configure(self, **params):
+		pass
+
+	# no colors, the LEDs keep their colors
+	def render(self, t, count):
+		return []
+
+	# set the colors of the LEDs for the time now
+	def apply(self, now, leds):
+		colors = self.render(now - self.start, len(leds))
+		for led, (r, g, b) in zip(leds, colors):
+			led.set_rgb(r, g, b)
+
+	def to_dict(self):
+		return {'effect': self.name, 'params': self.params}
+
+
+# the red, green and blue channels follow phase shifted sine waves (the former
+# animation of the web interface), spread shifts the phase from LED to LED
+class SineEffect(Effect):
+	name = 'sine'
+	defaults = {'speed': 0.04, 'spread': 0.0}
+
+	def configure(self, speed, spread):
+		self.speed = float(speed)
+		self.spread = float(spread)
+
+	def render(self, t, count):
+		colors = []
+		for idx in range(count):
+			x = 2 * math.pi * (self.speed * t + self.spread * idx)
+			colors.append((int((math.sin(x) + 1) * 127.5),
+					int((math.sin(x + 1.8) + 1) * 127.5),
+					int((math.sin(x + 2.5) + 1) * 127.5)))
+		return colors
+
+
+# cycles through the hues, spread is the part of the color wheel covered by
+# the LEDs of the set
+class RainbowEffect(Effect):
+	name = 'rainbow'
+	defaults = {'speed': 0.1, 'spread': 1.0}
+
+	def configure(self, speed, spread):
+		self.speed = float(speed)
+		self.spread = float(spread)
+
+	def render(self, t, count):
+		colors = []
+		for idx in range(count):
+			hue = (self.speed * t + self.spread * idx / count) % 1.0
+			r, g, b = colorsys.hsv_to_rgb(hue, 1.0, 1.0)
+			colors.append((int(r * 255), int(g * 255), int(b * 255)))
+		return colors
+
+
+# width LEDs in color move along the set, speed in LEDs per second
+class ChaseEffect(Effect):
+	name = 'chase'
+	defaults = {'speed': 4.0, 'width': 1, 'color': {'r': 255, 'g': 255, 'b': 255},
+			'background': {'r': 0, 'g': 0, 'b': 0}}
+
+	def configure(self, speed, width, color, background):
+		self.speed = float(speed)
+		self.width = int(width)
+		self.color = rgb(color)
+		self.background = rgb(background)
+
+	def render(self, t, count):
+		if count == 0:
+			return []
+		position = int(self.speed * t)
+		return [self.color if (idx - position) % count < self.width else self.background
+				for idx in range(count)]
+
+
+# the color fades in and out, speed in breaths per second
+class BreatheEffect(Effect):
+	name = 'breathe'
+	defaults = {'speed': 0.25, 'color': {'r': 255, 'g': 255, 'b': 255}}
+
+	def configure(self, speed, color):
+		self.speed = float(speed)
+		self.color = rgb(color)
+
+	def render(self, t, count):
+		level = (1 - math.cos(2 * math.pi * self.speed * t)) / 2
+		return [scale(self.color, level)] * count
+
+
+# flashes per second, the LEDs are on for the duty cycle of a flash
+class StrobeEffect(Effect):
+	name = 'strobe'
+	defaults = {'rate': 5.0, 'duty': 0.5, 'color': {'r': 255, 'g': 255, 'b': 255}}
+
+	def configure(self, rate, duty, color):
+		self.rate = float(rate)
+		self.duty = float(duty)
+		self.color = rgb(color)
+
+	def render(self, t, count):
+		on = (self.rate * t) % 1.0 < self.duty
+		return [self.color if on else (0, 0, 0)] * count
+
+
+# linear fades between keyframes ({'time': seconds, 'color': {r, g, b}}),
+# with loop set the keyframes are repeated, otherwise the last color is kept
+class FadeEffect(Effect):
+	name = 'fade'
+	defaults = {'keyframes': [{'time': 0, 'color': {'r': 0, 'g': 0, 'b': 0}},
+			{'time': 1, 'color': {'r': 255, 'g': 255, 'b': 255}},
+			{'time': 2, 'color': {'r': 0, 'g': 0, 'b': 0}}], 'loop': True}
+
+	def configure(self, keyframes, loop):
+		self.keyframes = sorted((float(keyframe['time']), rgb(keyframe['color']))
+				for keyframe in keyframes)
+		if not self.keyframes:
+			raise ValueError('no keyframes')
+		self.loop = bool(loop)
+
+	def render(self, t, count):
+		duration = self.keyframes[-1][0]
+		if self.loop and duration > 0:
+			t = t % duration
+		color = self.keyframes[-1][1]
+		for (t0, c0), (t1, c1) in zip(self.keyframes, self.keyframes[1:]):
+			if t0 <= t < t1:
+				level = (t - t0) / (t1 - t0)
+				color = tuple(int(a + (b - a) * level) for a, b in zip(c0, c1))
+				break
+		if t < self.keyframes[0][0]:
+			color = self.keyframes[0][1]
+		return [color] * count
+
+
+EFFECTS = dict((effect.name, effect) for effect in
+		[SineEffect, RainbowEffect, ChaseEffect, BreatheEffect, StrobeEffect, FadeEffect])
+
+# create an effect from its json representation ({'effect': name, 'params':
+# {...}}), raises ValueError for unknown effects or invalid parameters
+def create_effect(effect_json):
+	if effect_json.get('effect') not in EFFECTS:
+		raise ValueError('unknown effect')
+	try:
+		return EFFECTS[effect_json['effect']](effect_json.get('params'))
+	except (TypeError, KeyError, AttributeError) as e:
+		raise ValueError('invalid effect parameters: %s' % e)
+
+# the available effects and their default parameters
+def get_effects():
+	return [{'effect': name, 'params': EFFECTS[name].defaults} for name in sorted(EFFECTS)]
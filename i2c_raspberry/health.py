@@ -0,0 +1,93 @@
+#!/usr/bin/python
+import time
+
+# states of the circuit breaker of a controller
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+# consecutive failed writes after which a controller is skipped
+FAILURE_THRESHOLD = 3
+# time a controller is skipped after the breaker opened, doubled for every
+# failed probe up to BACKOFF_MAX (seconds)
+BACKOFF_MIN = 0.1
+BACKOFF_MAX = 5.0
+# time a controller counts as alive after a successful transfer (seconds)
+ALIVE_TIME = 1.0
+
+
+# Tracks the health of the bus transfers to one controller board.
+# Failures are counted instead of retried: after threshold consecutive failures
+# the breaker opens and the controller is skipped, so a board that doesn't
+# answer doesn't slow down the writes to the other boards. When the backoff
+# time has passed the next transfer is let through as a probe (half-open);
+# if it succeeds the breaker closes, otherwise it opens again with twice the
+# backoff time.
+class ControllerHealth(object):
+	__slots__ = ('threshold', 'backoff_min', 'backoff_max', 'state', 'failures',
+			'consecutive_failures', 'trips', 'backoff', 'retry_at', 'succeeded_at')
+
+	def __init__(self, threshold=FAILURE_THRESHOLD, backoff_min=BACKOFF_MIN,
+			backoff_max=BACKOFF_MAX):
+		self.threshold = threshold
+		self.backoff_min = backoff_min
+		self.backoff_max = backoff_max
+		self.state = CLOSED
+		self.failures = 0
+		self.consecutive_failures = 0
+		self.trips = 0
+		self.backoff = 0.0
+		self.retry_at = 0.0
+		self.succeeded_at = 0.0
+
+	# True if a transfer to the controller should be performed now
+	def allow(self, now=None):
+		if self.state == CLOSED:
+			return True
+		if now is None:
+			now = time.time()
+		if now < self.retry_at:
+			return False
+		self.state = HALF_OPEN
+		return True
+
+	def succeeded(self, now=None):
+		self.state = CLOSED
+		self.consecutive_failures = 0
+		self.backoff = 0.0
+		self.succeeded_at = now if now is not None else time.time()
+
+	# True if a transfer succeeded within the last ALIVE_TIME seconds
+	def alive(self, now=None):
+		if now is None:
+			now = time.time()
+		return now - self.succeeded_at < ALIVE_TIME
+
+	def failed(self, now=None):
+		self.failures += 1
+		self.consecutive_failures += 1
+		if (self.state == HALF_OPEN or
+				self.consecutive_failures >= self.threshold):
+			self.trip(now)
+
+	def trip(self, now=None):
+		if now is None:
+			now = time.time()
+		if self.state != OPEN:
+			self.trips += 1
+		self.backoff = min(max(self.backoff * 2, self.backoff_min), self.backoff_max)
+		self.retry_at = now + self.backoff
+		self.state = OPEN
+
+	# close the breaker, e.g. when the controller was found again
+	def reset(self):
+		self.succeeded()
+
+	def to_dict(self):
+		return {
+			'state': self.state,
+			'failures': self.failures,
+			'consecutive_failures': self.consecutive_failures,
+			'trips': self.trips,
+			'backoff': self.backoff
+		}
@@ -1,9 +1,11 @@
 import sys
+import errno
+import threading
 from contextlib import closing
 import posix
 from fcntl import ioctl
 from i2c_ctypes import *
-from ctypes import create_string_buffer, sizeof, c_int, byref, pointer, addressof, string_at
+from ctypes import create_string_buffer, sizeof, c_int, c_char, byref, pointer, addressof, string_at, memmove
 from board_revision import revision
 
 """ this version has been ported from python3 to support python2.x,
@@ -78,6 +80,246 @@ class I2CMaster(object):
         
         data = [i2c_msg_to_bytearray(m) for m in msgs if (m.flags & I2C_M_RD)]
         return data
+    
+    def perform(self, transaction):
+        """
+        Perform a prepared I2C I/O transaction.
+        
+        Arguments:
+        transaction -- an I2CTransaction. Data that is read is stored in
+                       the buffers the read messages were created with.
+        """
+        ioctl(self.fd, I2C_RDWR, transaction.ioctl_arg)
+
+
+class I2CTransaction(object):
+    """A prepared I2C I/O transaction that can be performed repeatedly.
+    
+    The message array and the ioctl argument are allocated once. Combined
+    with messages created by writing_from and reading_into, which refer
+    to the caller's buffers instead of copies, performing the transaction
+    again after updating the buffers does not allocate any memory.
+    
+    For example:
+    
+        data = bytearray(2)
+        t = I2CTransaction(writing_from(0x20, data))
+        with I2CMaster() as i2c:
+            data[0], data[1] = 0x01, 0xFF
+            i2c.perform(t)
+    """
+    
+    def __init__(self, *msgs):
+        self.nmsgs = len(msgs)
+        self.msgs = (i2c_msg*self.nmsgs)(*msgs)
+        self.ioctl_arg = i2c_rdwr_ioctl_data(msgs=self.msgs, nmsgs=self.nmsgs)
+        # the message array only holds pointers to the buffers, keep the
+        # messages that own them alive
+        self._msgs = msgs
+
+
+class I2CBatch(object):
+    """Combines the messages of several prepared transactions into as few
+    I2C_RDWR ioctls as the kernel accepts.
+    
+    The i2c_msg structures (not the data they point to) of the transactions
+    are copied into one preallocated message array. A transaction is never
+    split between two ioctls, so a chunk holds at most max_msgs messages.
+    """
+    
+    def __init__(self, max_msgs=I2C_RDWR_IOCTL_MAX_MSGS):
+        self.max_msgs = max_msgs
+        self.msgs = (i2c_msg*max_msgs)()
+        self.ioctl_arg = i2c_rdwr_ioctl_data(msgs=self.msgs, nmsgs=0)
+    
+    def chunks(self, transactions):
+        """
+        Loads the transactions chunk by chunk into the message array.
+        
+        Yields the list of transactions contained in the current chunk;
+        the batch can be performed like an I2CTransaction until the next
+        chunk is requested.
+        """
+        chunk = []
+        nmsgs = 0
+        for t in transactions:
+            if t.nmsgs > self.max_msgs:
+                raise ValueError("transaction exceeds %d messages" % self.max_msgs)
+            if nmsgs + t.nmsgs > self.max_msgs:
+                self.ioctl_arg.nmsgs = nmsgs
+                yield chunk
+                chunk = []
+                nmsgs = 0
+            memmove(addressof(self.msgs) + nmsgs*sizeof(i2c_msg),
+                    addressof(t.msgs), t.nmsgs*sizeof(i2c_msg))
+            chunk.append(t)
+            nmsgs += t.nmsgs
+        if chunk:
+            self.ioctl_arg.nmsgs = nmsgs
+            yield chunk
+
+
+# errors that are reported by the adapter for a single transfer (e.g. a slave
+# that does not acknowledge its address); the bus device itself is still usable
+_TRANSFER_ERRORS = (errno.EREMOTEIO, errno.ENXIO, errno.EIO, errno.ETIMEDOUT,
+                    errno.EAGAIN)
+# errors that indicate a stale file descriptor, the device is reopened
+# and the transaction is repeated once
+_STALE_ERRORS = (errno.EBADF, errno.ENODEV)
+
+
+class I2CSession(object):
+    """A long-lived, thread-safe connection to one I2C bus.
+    
+    In contrast to the I2CMaster, an I2CSession keeps the bus device open
+    between transactions, so that repeated transactions do not pay for
+    opening and closing the device file each time. The device is opened
+    lazily on the first transaction. If the file descriptor becomes
+    unusable it is closed and the device is transparently reopened.
+    
+    Sessions are meant to be shared; use the session function to get the
+    session of a bus instead of creating instances directly.
+    
+    For example:
+    
+        bus = session()
+        bus.transaction(
+            writing(0x20, bytes([0x01, 0xFF])))
+    """
+    
+    def __init__(self, n=default_bus, extra_open_flags=0):
+        self.n = n
+        self.extra_open_flags = extra_open_flags
+        self.master = None
+        self.batch = I2CBatch()
+        self.lock = threading.RLock()
+    
+    def open(self):
+        """Opens the bus device, if it is not already open."""
+        with self.lock:
+            if self.master is None:
+                self.master = _master_factory(self.n, self.extra_open_flags)
+            return self.master
+    
+    def close(self):
+        """Closes the bus device, the next transaction reopens it."""
+        with self.lock:
+            if self.master is not None:
+                master, self.master = self.master, None
+                try:
+                    master.close()
+                except OSError:
+                    pass
+    
+    def transaction(self, *msgs):
+        """
+        Perform an I2C I/O transaction on the shared bus device.
+        
+        Arguments and return value are the same as for
+        I2CMaster.transaction.
+        """
+        return self._run('transaction', *msgs)
+    
+    def perform(self, transaction):
+        """
+        Perform a prepared I2C I/O transaction on the shared bus device.
+        
+        Arguments are the same as for I2CMaster.perform.
+        """
+        return self._run('perform', transaction)
+    
+    def perform_batch(self, transactions, once=()):
+        """
+        Perform several prepared I2C I/O transactions with as few ioctls
+        as possible.
+        
+        If an ioctl fails, the transactions it contained are performed
+        one by one, so that a device that does not respond doesn't keep
+        the data from reaching the other devices. The transactions before
+        the failing message may already have been delivered, so they are
+        performed twice: transactions that must not be repeated are passed
+        in once and performed in an ioctl of their own.
+        
+        Arguments:
+        transactions -- a sequence of I2CTransactions.
+        once -- the transactions among them that must not be repeated.
+        
+        Returns: a list of (transaction, exception) tuples, one for each
+                 transaction that could not be performed.
+        """
+        failed = []
+        with self.lock:
+            batched = []
+            for t in transactions:
+                if t not in once:
+                    batched.append(t)
+                    continue
+                failed += self._perform_chunks(batched)
+                batched = []
+                try:
+                    self._run('perform', t)
+                except (IOError, OSError) as e:
+                    failed.append((t, e))
+            failed += self._perform_chunks(batched)
+        return failed
+    
+    def _perform_chunks(self, transactions):
+        failed = []
+        for chunk in self.batch.chunks(transactions):
+            try:
+                self._run('perform', self.batch)
+                continue
+            except (IOError, OSError) as e:
+                if len(chunk) == 1:
+                    failed.append((chunk[0], e))
+                    continue
+            for t in chunk:
+                try:
+                    self._run('perform', t)
+                except (IOError, OSError) as e:
+                    failed.append((t, e))
+        return failed
+    
+    def _run(self, method, *args):
+        with self.lock:
+            try:
+                return getattr(self.open(), method)(*args)
+            except (IOError, OSError) as e:
+                if e.errno in _TRANSFER_ERRORS:
+                    raise
+                self.close()
+                if e.errno not in _STALE_ERRORS:
+                    raise
+            return getattr(self.open(), method)(*args)
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+_master_factory = I2CMaster
+
+def session(n=default_bus):
+    """Returns the shared I2CSession of bus n, creating it if required."""
+    with _sessions_lock:
+        if n not in _sessions:
+            _sessions[n] = I2CSession(n)
+        return _sessions[n]
+
+def close_sessions():
+    """Closes the bus devices of all shared sessions."""
+    with _sessions_lock:
+        for bus in _sessions.values():
+            bus.close()
+
+def use_master(factory):
+    """Selects the class that sessions use to open a bus device.
+    
+    The factory is called like I2CMaster(n, extra_open_flags), e.g. to
+    replace the hardware by a simulated bus. Open sessions are closed,
+    so that the next transaction opens the bus with the new factory.
+    """
+    global _master_factory
+    _master_factory = factory
+    close_sessions()
 
 
 def reading(addr, n_bytes):
@@ -85,7 +327,10 @@ def reading(addr, n_bytes):
     return reading_into(addr, create_string_buffer(n_bytes))
 
 def reading_into(addr, buf):
-    """An I2C I/O message that reads into an existing ctypes string buffer."""
+    """An I2C I/O message that reads into an existing ctypes string buffer
+    or bytearray."""
+    if isinstance(buf, bytearray):
+        buf = _buffer_view(buf)
     return _new_i2c_msg(addr, I2C_M_RD, buf)
 
 def writing_bytes(addr, *str):
@@ -93,21 +338,52 @@ def writing_bytes(addr, *str):
     
     Each byte is passed as an argument to this function.
     """
-    buf = bytearray([i for i in str])
-    return writing(addr, buf)
+    return writing_from(addr, bytearray(str))
 
 def writing(addr, byte_seq):
     """An I2C I/O message that writes one or more bytes of data.
     
-    The bytes are passed to this function as a sequence.
+    The bytes are passed to this function as a sequence. A bytearray
+    is not copied, see writing_from.
     """
-    buf = str(byte_seq)
-    return _new_i2c_msg(addr, 0, create_string_buffer(buf, len(buf)))
+    if isinstance(byte_seq, bytearray):
+        return writing_from(addr, byte_seq)
+    if not isinstance(byte_seq, str):
+        return writing_from(addr, bytearray(byte_seq))
+    return _new_i2c_msg(addr, 0, create_string_buffer(byte_seq, len(byte_seq)))
+
+def writing_register(addr, register, byte_seq):
+    """An I2C I/O message that writes one or more bytes of data to a register.
+    
+    The register address is sent as the first byte of the message, so
+    that the write requires a single message instead of a message that
+    sets the register pointer followed by a message with the data.
+    """
+    buf = bytearray(len(byte_seq) + 1)
+    buf[0] = register
+    buf[1:] = byte_seq
+    return writing_from(addr, buf)
+
+def writing_from(addr, buf):
+    """An I2C I/O message that writes the contents of an existing bytearray
+    or ctypes string buffer.
+    
+    The data is not copied: the message refers to the memory of buf, so
+    changes to buf are visible to every transaction performed with the
+    message afterwards.
+    """
+    if isinstance(buf, bytearray):
+        buf = _buffer_view(buf)
+    return _new_i2c_msg(addr, 0, buf)
 
 
 def _new_i2c_msg(addr, flags, buf):
     return i2c_msg(addr=addr, flags=flags, len=sizeof(buf), buf=buf)
 
 
+def _buffer_view(byte_array):
+    return (c_char*len(byte_array)).from_buffer(byte_array)
+
+
 def i2c_msg_to_bytearray(m):
-    return bytearray([char for char in string_at(m.buf, m.len)])
+    return bytearray(string_at(m.buf, m.len))
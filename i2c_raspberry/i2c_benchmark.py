@@ -0,0 +1,395 @@
+#!/usr/bin/python
+import time
+import sys
+import os
+import gc
+import io
+import json
+import shutil
+import tempfile
+from ctypes import create_string_buffer
+
+import i2c as i2c
+import i2c_sim
+from i2c_raspberry import RgbController, RgbCoordinator, RgbLedSet, FrameBuffer
+from i2c_raspberry import STATE_RANGE, RX_BRIGHTNESS, LED_CHANNELS, FRAME_RECORD_ADDR, FRAME_RECORD_REGISTERS
+from calibration import Calibration
+import color
+from color import ColorCalibration
+from calibration import interpolate_resistor_value, calculate_digital_resistor_input
+
+''' builds the I2C messages for one frame the way RgbController.update
+did before the transactions were prepared (kept as reference) '''
+def legacy_frame_messages(controller):
+	length = bytearray(1)
+	length[0] = 23 + 1
+	register = bytearray([i for i in (0x00,)])
+	register = str(register)
+	data = str(bytearray(controller.i2c_buffer[0:23]) + length)
+	msgs = (i2c.i2c_msg(addr=controller.i2c_address, flags=0, len=1,
+				buf=create_string_buffer(register, len(register))),
+			i2c.i2c_msg(addr=controller.i2c_address, flags=0, len=len(data),
+				buf=create_string_buffer(data, len(data))))
+	msg_array = (i2c.i2c_msg*len(msgs))(*msgs)
+	return i2c.i2c_rdwr_ioctl_data(msgs=msg_array, nmsgs=len(msgs))
+
+''' loads the prepared I2C messages for one frame '''
+def prepared_frame_messages(controller):
+	return controller.write.load(*STATE_RANGE).ioctl_arg
+
+''' the objects that exist, by id: the objects tracked by the garbage
+collector and the objects they refer to (e.g. strings and numbers). The
+objects are kept referenced, so their ids are not reused '''
+def known_objects():
+	gc.collect()
+	objects = gc.get_objects()
+	known = dict((id(obj), obj) for obj in objects)
+	for obj in objects:
+		for referent in gc.get_referents(obj):
+			known[id(referent)] = referent
+	return known
+
+''' the number and the size (bytes, sys.getsizeof) of the objects a value
+refers to, directly or indirectly, that are not known '''
+def new_objects(value, known):
+	stack = [value]
+	seen = set()
+	count = size = 0
+	while stack:
+		obj = stack.pop()
+		if id(obj) in seen or id(obj) in known:
+			continue
+		seen.add(id(obj))
+		count += 1
+		size += sys.getsizeof(obj)
+		stack.extend(gc.get_referents(obj))
+	return count, size
+
+''' the objects allocated for the messages of one frame: the transaction and
+everything it refers to that didn't exist before '''
+def frame_allocations(build_messages, controller):
+	build_messages(controller)
+	known = known_objects()
+	return new_objects(build_messages(controller), known)
+
+''' compares the time and memory required to build the I2C messages for
+a frame with the legacy and the prepared message construction '''
+def message_construction(frames=100000):
+	controller = RgbController(0x20, 'benchmark')
+	for name, build_messages in [('legacy', legacy_frame_messages),
+				('prepared', prepared_frame_messages)]:
+		start = time.time()
+		for _ in range(frames):
+			build_messages(controller)
+		duration = time.time() - start
+		objects, allocated = frame_allocations(build_messages, controller)
+		print("%-10s %8.2f us/frame  %d objects, %d bytes allocated/frame" % (name,
+			duration * 1000000.0 / frames, objects, allocated))
+
+''' counts the bytes a prepared transaction puts on the wire (one address
+byte per message plus the data), the start / repeated start and stop
+conditions, and the resulting bit times (8 data bits + ACK per byte, about
+one bit time per start or stop condition) '''
+def wire_cost(transaction):
+	msgs = transaction.ioctl_arg.msgs
+	nmsgs = transaction.ioctl_arg.nmsgs
+	wire_bytes = 0
+	for idx in range(nmsgs):
+		wire_bytes += 1 + msgs[idx].len
+	starts = nmsgs
+	stops = 1
+	bits = wire_bytes * 9 + starts + stops
+	return wire_bytes, starts, stops, bits
+
+''' compares full state writes with a separate register address message and
+in register write mode. The achievable frame rate is calculated for the given
+bus clock (Hz), then the frames are written to the controller at the given
+address for duration seconds. Without a bus number a simulated bus is used '''
+def register_write_modes(bus=None, address=0x20, clock=100000, duration=5):
+	for name, register_writes in [('two messages', False),
+				('register write', True)]:
+		controller = RgbController(address, 'benchmark', register_writes=register_writes)
+		wire_bytes, starts, stops, bits = wire_cost(controller.write.load(*STATE_RANGE))
+		print("%-15s %3d bytes  %d start(s)  %d stop(s)  %6.1f frames/s at %d kHz" % (
+			name, wire_bytes, starts, stops, float(clock) / bits, clock / 1000))
+		if bus is None:
+			i2c_sim.install({0: [address]}, clock, register_writes=register_writes)
+			controller.bus = i2c.session(0)
+		else:
+			controller.bus = i2c.session(bus)
+		frames = 0
+		errors = 0
+		start = time.time()
+		while time.time() - start < duration:
+			try:
+				controller.bus.perform(controller.write.load(*STATE_RANGE))
+				frames += 1
+			except IOError as e:
+				errors += 1
+		print("%-15s %6.1f frames/s measured, %d errors" % (
+			'', frames / (time.time() - start), errors))
+
+''' converts the current limits the way RgbLed.convert_current_limit did
+before the calibration tables were compiled (kept as reference) '''
+class InterpolatingCalibration(object):
+	def lookup(self, current_limit):
+		r_ext = interpolate_resistor_value(current_limit)
+		return calculate_digital_resistor_input(r_ext)
+
+	def table(self, addr, channel):
+		return self
+
+''' compares the time the conversion of the current limits of all LEDs of a
+simulated fleet takes (as done for every frame before the LEDs were mapped
+to the frame buffer) with the limits interpolated and looked up in the
+compiled calibration tables '''
+def current_limit_conversion(controllers=100, frames=1000):
+	for name, calibration in [('interpolated', InterpolatingCalibration()),
+				('table', Calibration())]:
+		fleet = []
+		for n, addresses in i2c_sim.fleet(controllers).items():
+			for address in addresses:
+				fleet.append(RgbController(address, 'benchmark', addr=n*128+address,
+						calibration=calibration))
+		for idx, controller in enumerate(fleet):
+			for led in controller.leds:
+				led.set_current_limit(50 + (idx * 7 + led.channel * 53) % 450)
+		start = time.time()
+		for _ in range(frames):
+			for controller in fleet:
+				for led in controller.leds:
+					led.convert_current_limit()
+		duration = time.time() - start
+		print("%-12s %8.2f us/controller  %8.2f ms/frame (%d controllers)" % (name,
+			duration * 1000000.0 / (frames * controllers),
+			duration * 1000.0 / frames, controllers))
+
+''' resident set size of the process in bytes (Linux) '''
+def resident_memory():
+	with open('/proc/self/statm') as statm:
+		return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+''' memory and per-frame cost of the model of a fleet of simulated
+controllers with an LED-Set per controller. Reports the memory of the
+model per LED (the size of the objects of the model, see new_objects, and
+the growth of the resident set size), and the time per frame to change every
+LED and prepare the writes, and to serialize the model for the RESTful API '''
+def model_memory(controllers=1000, frames=20):
+	bus_addresses = i2c_sim.fleet(controllers)
+	i2c_sim.install(bus_addresses, realtime=False)
+	known = known_objects()
+	rss = resident_memory()
+	frame = FrameBuffer(128 * len(bus_addresses))
+	calibration = Calibration()
+	fleet = []
+	led_sets = []
+	for n, addresses in sorted(bus_addresses.items()):
+		for address in addresses:
+			controller = RgbController(address, 'Controller', bus=n,
+					addr=n*128+address, calibration=calibration, frame=frame)
+			led_set = RgbLedSet('Set%d' % controller.addr)
+			for led in controller.leds:
+				led_set.add_led(led)
+			fleet.append(controller)
+			led_sets.append(led_set)
+	rss = resident_memory() - rss
+	objects, size = new_objects((frame, calibration, fleet, led_sets), known)
+	del known
+	leds = sum(len(controller.leds) for controller in fleet)
+	print("%d controllers, %d LEDs: %d bytes/LED (%.1f objects/LED), %.0f bytes/LED RSS" % (
+		len(fleet), leds, size // leds, float(objects) / leds, float(rss) / leds))
+
+	start = time.time()
+	for frame_no in range(frames):
+		for controller in fleet:
+			for led in controller.leds:
+				led.set_color(dict(r=frame_no % 256, b=led.channel))
+			controller.prepare_update()
+	duration = time.time() - start
+	print("%-10s %8.2f ms/frame  %6.2f us/LED" % ('frame', duration * 1000.0 / frames,
+		duration * 1000000.0 / (frames * leds)))
+	start = time.time()
+	for _ in range(frames):
+		[controller.to_dict() for controller in fleet]
+		[led_set.to_dict() for led_set in led_sets]
+	duration = time.time() - start
+	print("%-10s %8.2f ms/frame  %6.2f us/LED" % ('to_dict', duration * 1000.0 / frames,
+		duration * 1000000.0 / (frames * leds)))
+
+''' measures the color calibration of a complete installation (all blocks of
+the frame buffer, every LED with a matrix) with numpy if it is available
+and with the per LED fallback '''
+def color_calibration(blocks=256, frames=100):
+	frame = FrameBuffer(blocks)
+	calibration = ColorCalibration(frame)
+	matrix = [[0.9, 0.1, 0.0, 0.0], [0.0, 0.8, 0.0, 0.1], [0.0, 0.0, 0.8, 0.1],
+			[0.05, 0.0, 0.0, 0.7]]
+	for block in range(blocks):
+		for led in range(4):
+			calibration.set_led(block, led, matrix, [1.0, 0.9, 0.85])
+	numpy = color.numpy
+	for name, module in [('numpy', numpy), ('python', None)]:
+		if name == 'numpy' and numpy is None:
+			print("%-10s n/a" % name)
+			continue
+		color.numpy = module
+		start = time.time()
+		for idx in range(frames):
+			frame.fill(idx % 16, idx % 256)
+			calibration.render()
+		duration = time.time() - start
+		print("%-10s %8.2f ms/frame  %6.2f us/LED" % (name, duration * 1000.0 / frames,
+			duration * 1000000.0 / (frames * blocks * 4)))
+	color.numpy = numpy
+
+''' changes the color of every LED of the installation '''
+def change_all_leds(coordinator, frame):
+	for controller in coordinator.controllers.values():
+		for led in controller.leds:
+			led.set_color(dict(r=frame % 256, g=(frame + led.channel) % 256))
+
+''' changes the color of a single LED per frame, like the live mode of the
+web interface '''
+def change_one_led(coordinator, frame):
+	controllers = sorted(coordinator.controllers.keys())
+	controller = coordinator.controllers[controllers[frame % len(controllers)]]
+	controller.get_led(frame % controller.led_cnt).set_color(dict(b=frame % 256))
+
+''' load test of the complete frame path (coordinator, executors, batched
+transfers) with a fleet of simulated controllers, distributed over as many
+buses as required. Before every frame the LEDs are changed by the change
+function, then the changes are written as fast as the buses allow for
+duration seconds '''
+def simulated_fleet(controllers=200, per_bus=100, clock=100000, error_rate=0.0,
+			duration=5, change=change_all_leds):
+	buses = i2c_sim.install(i2c_sim.fleet(controllers, per_bus), clock, error_rate)
+	coordinator = RgbCoordinator(sorted(buses.keys()))
+	coordinator.scan_i2c_bus()
+	stats = dict((n, (bus.busy_time, bus.transfers, bus.messages, bus.bytes, bus.errors))
+			for n, bus in buses.items())
+	frames = 0
+	start = time.time()
+	while time.time() - start < duration:
+		change(coordinator, frames)
+		for future in coordinator.request_update().values():
+			future.result()
+		frames += 1
+	duration = time.time() - start
+	coordinator.stop()
+	print("%d controllers on %d buses at %d kHz, %s: %.1f frames/s" % (
+		len(coordinator.controllers), len(buses), clock / 1000, change.__name__,
+		frames / duration))
+	for n, bus in sorted(buses.items()):
+		busy_time, transfers, messages, wire_bytes, errors = stats[n]
+		print("bus %d: %5.1f%% busy, %d transfers, %d messages, %d bytes, %d NAKs" % (n,
+			(bus.busy_time - busy_time) * 100.0 / duration, bus.transfers - transfers,
+			bus.messages - messages, bus.bytes - wire_bytes, bus.errors - errors))
+
+''' the JSON bodies of the controller API that set the colors and the
+brightness of every LED of the installation for a frame '''
+def json_frame(coordinator, frame):
+	bodies = []
+	for addr, controller in sorted(coordinator.controllers.items()):
+		controller_json = {'brightness': frame % 256, 'leds': [{'channel': led.channel,
+				'color': dict(r=frame % 256, g=led.channel, b=0)} for led in controller.leds]}
+		bodies.append((addr, json.dumps(controller_json)))
+	return bodies
+
+''' the binary frame that sets the same registers '''
+def binary_frame(coordinator, frame):
+	records = bytearray()
+	for addr, controller in sorted(coordinator.controllers.items()):
+		registers = bytearray(controller.i2c_buffer[:FRAME_RECORD_REGISTERS])
+		registers[RX_BRIGHTNESS] = frame % 256
+		for led in controller.leds:
+			start = led.channel * LED_CHANNELS
+			registers[start:start+LED_CHANNELS] = bytearray([frame % 256,
+					led.channel, led.channel, 0])
+		records += FRAME_RECORD_ADDR.pack(addr) + registers
+	return records
+
+''' compares the time required to apply the colors of a complete installation
+of simulated controllers with the controller API (a JSON patch parsed and
+applied per controller) and as a binary frame. The bodies are prepared in advance,
+the time includes parsing but not the HTTP requests '''
+def frame_ingestion(controllers=256, frames=30):
+	buses = i2c_sim.install(i2c_sim.fleet(controllers), realtime=False)
+	coordinator = RgbCoordinator(sorted(buses.keys()))
+	coordinator.scan_i2c_bus()
+	json_frames = [json_frame(coordinator, frame) for frame in range(frames)]
+	binary_frames = [binary_frame(coordinator, frame) for frame in range(frames)]
+	start = time.time()
+	for bodies in json_frames:
+		for addr, body in bodies:
+			coordinator.patch_controller(json.loads(body), addr)
+	json_duration = time.time() - start
+	start = time.time()
+	for data in binary_frames:
+		coordinator.ingest_frame(str(data))
+	binary_duration = time.time() - start
+	coordinator.stop()
+	for name, duration, size in [('json', json_duration, sum(len(body)
+				for _, body in json_frames[0])),
+			('binary', binary_duration, len(binary_frames[0]))]:
+		print("%-10s %8.2f ms/frame  %6.1f frames/s  %6d bytes/frame (%d controllers)" % (
+			name, duration * 1000.0 / frames, frames / duration, size,
+			len(coordinator.controllers)))
+
+''' stores the LED-Sets the way RgbCoordinator.store_led_sets did before
+they were stored in the background (kept as reference) '''
+def legacy_store_led_sets(coordinator):
+	with io.open('led_set.json', 'w', encoding='utf-8') as led_set_file:
+		led_sets = coordinator.get_led_sets() + coordinator.pending_led_sets
+		led_set_file.write(json.dumps(led_sets, ensure_ascii=False))
+
+''' compares the time slider-driven changes of a LED-Set take in the request
+and the number of writes of the storage file, with the LED-Sets stored
+synchronously after every change, in the background and in the journal.
+There is a LED-Set per simulated controller, the changes of one of them
+arrive at the given rate (changes/s) '''
+def led_set_storage(controllers=100, updates=200, rate=50.0):
+	buses = i2c_sim.install(i2c_sim.fleet(controllers), realtime=False)
+	cwd = os.getcwd()
+	for name in ['synchronous', 'background', 'journal']:
+		directory = tempfile.mkdtemp()
+		os.chdir(directory)
+		try:
+			coordinator = RgbCoordinator(sorted(buses.keys()), journal=(name == 'journal'))
+			coordinator.scan_i2c_bus()
+			for addr, controller in sorted(coordinator.controllers.items()):
+				coordinator.add_led_set({'name': u'Set%d' % addr, 'status': 'on',
+						'leds': [led.to_dict() for led in controller.leds]})
+			if name == 'synchronous':
+				coordinator.store_led_sets = lambda *names: legacy_store_led_sets(coordinator)
+			led_set_name = sorted(coordinator.led_sets.keys())[0]
+			time.sleep(coordinator.store.delay * 2)
+			writes = coordinator.store.writes
+			duration = 0.0
+			for update in range(updates):
+				start = time.time()
+				coordinator.patch_led_set({'color': {'r': update % 256}}, led_set_name)
+				duration += time.time() - start
+				time.sleep(1.0 / rate)
+			coordinator.stop()
+			if name == 'synchronous':
+				writes = updates
+			else:
+				writes = coordinator.store.writes - writes
+			print("%-12s %8.3f ms/change  %4d writes for %d changes (%d LED-Sets)" % (name,
+				duration * 1000.0 / updates, writes, updates, len(coordinator.led_sets)))
+		finally:
+			os.chdir(cwd)
+			shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+	frames = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+	message_construction(frames)
+	current_limit_conversion()
+	model_memory()
+	color_calibration()
+	frame_ingestion()
+	led_set_storage()
+	register_write_modes(int(sys.argv[2]) if len(sys.argv) > 2 else None)
+	simulated_fleet()
+	simulated_fleet(change=change_one_led)
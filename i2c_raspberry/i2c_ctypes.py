@@ -54,3 +54,4 @@ I2C_SLAVE_FORCE	= 0x0706	# Change slave address
 I2C_TENBIT	= 0x0704	# 0 for 7 bit addrs, != 0 for 10 bit	
 I2C_FUNCS	= 0x0705	# Get the adapter functionality         
 I2C_RDWR	= 0x0707	# Combined R/W transfer (one stop only) 
+I2C_RDWR_IOCTL_MAX_MSGS	= 42	# max number of messages per I2C_RDWR ioctl
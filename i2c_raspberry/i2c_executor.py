@@ -0,0 +1,94 @@
+#!/usr/bin/python
+import sys
+import threading
+import itertools
+import Queue
+
+# priorities of bus jobs, jobs with lower values are executed first
+PRIORITY_FRAME = 0
+PRIORITY_TELEMETRY = 5
+PRIORITY_DISCOVERY = 10
+
+
+# The result of a job submitted to an I2CExecutor
+class I2CFuture(object):
+	def __init__(self):
+		self.finished = threading.Event()
+		self.value = None
+		self.error = None
+
+	# True when the job has been executed
+	def done(self):
+		return self.finished.is_set()
+
+	# wait for the job and return its result, or raise its exception
+	def result(self, timeout=None):
+		if not self.finished.wait(timeout):
+			raise IOError('I2C job did not complete in time')
+		if self.error is not None:
+			raise self.error
+		return self.value
+
+	def exception(self):
+		return self.error
+
+	def set_result(self, value):
+		self.value = value
+		self.finished.set()
+
+	def set_exception(self, error):
+		self.error = error
+		self.finished.set()
+
+
+# Executes all I2C bus traffic in a dedicated worker thread, so that the
+# callers (e.g. the request handlers of the web interface) never block on the
+# bus. Jobs are executed in order of priority and submission. A job that is
+# submitted with the key of a queued job that didn't start yet is merged into
+# it: both callers receive the same future, and since the job reads the state
+# when it is executed, the latest state is written.
+class I2CExecutor(object):
+	def __init__(self, name='i2c-executor'):
+		self.queue = Queue.PriorityQueue()
+		self.pending = {}
+		self.lock = threading.Lock()
+		self.sequence = itertools.count()
+		self.thread = threading.Thread(target=self.run, name=name)
+		self.thread.daemon = True
+
+	def start(self):
+		self.thread.start()
+
+	def stop(self):
+		self.queue.put((sys.maxint, next(self.sequence), None))
+
+	def submit(self, func, *args, **kwargs):
+		priority = kwargs.pop('priority', PRIORITY_FRAME)
+		key = kwargs.pop('key', None)
+		with self.lock:
+			if key is not None and key in self.pending:
+				return self.pending[key]
+			future = I2CFuture()
+			if key is not None:
+				self.pending[key] = future
+			job = (func, args, kwargs, key, future)
+			self.queue.put((priority, next(self.sequence), job))
+		return future
+
+	# number of jobs waiting for execution
+	def backlog(self):
+		return self.queue.qsize()
+
+	def run(self):
+		while True:
+			_, _, job = self.queue.get()
+			if job is None:
+				break
+			func, args, kwargs, key, future = job
+			if key is not None:
+				with self.lock:
+					del self.pending[key]
+			try:
+				future.set_result(func(*args, **kwargs))
+			except Exception as e:
+				future.set_exception(e)
@@ -1,11 +1,23 @@
 #!/usr/bin/python
-import decorator
 import time
+import threading
 import sys, os, io, json
+import struct
+from functools import partial
 from random import randint
 from pprint import pprint
 
 import i2c as i2c
+from calibration import Calibration, default_table
+from discovery import ControllerDiscovery
+from health import ControllerHealth, CLOSED, OPEN
+from i2c_executor import I2CExecutor, PRIORITY_TELEMETRY
+from telemetry import TelemetryPoller
+from render import RenderLoop, FRAME_RATE
+from effects import create_effect
+from changes import ChangeLog
+from storage import LedSetStore, STORE_DELAY
+from color import ColorPipeline, ColorCalibration, default_pipeline, GAMMA
 
 LED_CNT = 4
 LED_CHANNELS = 4
@@ -14,28 +26,38 @@ RX_RGB_LED = 0
 RX_CURRENT_LIMIT = 16
 RX_CURRENT_UPDATE = 20
 RX_BRIGHTNESS = 21
-
-def retry(howmany, *exception_types, **kwargs):
-	timeout = kwargs.get('timeout', None) # seconds
-	@decorator.decorator
-	def try_it(func, *fargs, **fkwargs):
-			for _ in range(howmany):
-					try:
-						return func(*fargs, **fkwargs)
-					except exception_types as e:
-						print("I/O Exception, retry %d" % _)
-						exc_type, exc_obj, exc_tb = sys.exc_info()
-						fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
-						print(exc_type, fname, exc_tb.tb_lineno)
-						if timeout is not None: time.sleep(timeout)
-	return try_it
+TX_SIZE = 16
+TX_CURRENT_LIMIT = 0
+TX_MESSAGE_CNT = 4
+TX_MESSAGE = 5
+# register ranges that are written to the controller boards (start, size)
+COLOR_RANGE = (RX_RGB_LED, 16)
+LIMITS_RANGE = (RX_CURRENT_LIMIT, 5)
+BRIGHTNESS_RANGE = (RX_BRIGHTNESS, 1)
+STATE_RANGE = (RX_RGB_LED, 23)
+# the channels of a color in the API
+COLOR_KEYS = ('r', 'g', 'g1', 'g2', 'b')
+# a binary frame is a sequence of records of the registers of a controller:
+# its addr (2 bytes, big endian) followed by the registers from RX_RGB_LED to
+# RX_BRIGHTNESS, in the layout of its register block (the current limit update
+# register is ignored)
+FRAME_RECORD_ADDR = struct.Struct('>H')
+FRAME_RECORD_REGISTERS = RX_BRIGHTNESS + 1 - RX_RGB_LED
+FRAME_RECORD_SIZE = FRAME_RECORD_ADDR.size + FRAME_RECORD_REGISTERS
+# send the register address as first byte of the data instead of a separate
+# message, requires firmware built with TWI_REGISTER_PREFIX
+REGISTER_WRITES = False
 
 
 class RgbLedSet(object):
+	__slots__ = ('leds', 'name', 'status', 'effect')
+
 	def __init__(self, name="undef"):
 		self.leds = []
 		self.name = name
 		self.status = 'on'
+		# the effect that animates the LEDs of the set, if any
+		self.effect = None
 	
 	def set_name(self, new_name):
 		self.name = new_name
@@ -71,21 +93,73 @@ class RgbLedSet(object):
 		led_set_dict = {
 			'name': self.name,
 			'leds': led_list,
-			'status' : self.status
+			'status' : self.status,
+			'effect': self.effect.to_dict() if self.effect is not None else None
 		}
 		
 		return led_set_dict
 
 
+# The LED is a view onto the register block of its controller in the frame
+# buffer: the color and the current limit are written directly into the bytes
+# that are sent to the board. While the LED is disabled its color is kept in
+# saved_color and the channels in the frame are off.
 class RgbLed(object):
-	def __init__(self, master_addr, channel, current_limit=245):
-		self.current_limit = current_limit
-		self.channels = [0, 0, 0, 0]
-		self.current_limit_update = False
+	__slots__ = ('frame', 'offset', 'master_addr', 'channel', 'led_set',
+			'calibration', 'current_limit', 'saved_color')
+
+	def __init__(self, master_addr, channel, current_limit=245, calibration=None,
+			frame=None, offset=0):
+		self.frame = frame if frame is not None else bytearray(RX_SIZE)
+		self.offset = offset
 		self.master_addr = master_addr
 		self.channel = channel
 		self.led_set = 'none'
-		self.enabled = True
+		self.saved_color = None
+		self.calibration = calibration if calibration is not None else default_table
+		self.current_limit = int(current_limit)
+		self.frame[self.limit_offset()] = self.convert_current_limit()
+
+	def color_offset(self):
+		return self.offset + RX_RGB_LED + self.channel * LED_CHANNELS
+
+	def limit_offset(self):
+		return self.offset + RX_CURRENT_LIMIT + self.channel
+
+	# the buffer and offset the color channels are currently stored at
+	def color_buffer(self):
+		if self.saved_color is None:
+			return self.frame, self.color_offset()
+		return self.saved_color, 0
+
+	@property
+	def channels(self):
+		buf, offset = self.color_buffer()
+		return list(buf[offset:offset+LED_CHANNELS])
+
+	@property
+	def enabled(self):
+		return self.saved_color is None
+
+	@enabled.setter
+	def enabled(self, enabled):
+		start = self.color_offset()
+		end = start + LED_CHANNELS
+		if self.saved_color is None and not enabled:
+			self.saved_color = self.frame[start:end]
+			self.frame[start:end] = bytearray(LED_CHANNELS)
+		elif enabled and self.saved_color is not None:
+			self.frame[start:end] = self.saved_color
+			self.saved_color = None
+
+	# the flag is shared by the LEDs of a controller, like in the firmware
+	@property
+	def current_limit_update(self):
+		return self.frame[self.offset+RX_CURRENT_UPDATE] != 0x00
+
+	@current_limit_update.setter
+	def current_limit_update(self, update):
+		self.frame[self.offset+RX_CURRENT_UPDATE] = 0x01 if update else 0x00
 
 	def __eq__(self, other):
 		return self.master_addr == other.master_addr and self.channel == other.channel
@@ -100,33 +174,50 @@ class RgbLed(object):
 		g2 = rgb_color.get('g2', None)
 		b = rgb_color.get('b', None)
 
-		if r is not None: self.channels[0] = r
-		if g is not None: self.channels[1] = self.channels[2] = g
-		if g1 is not None: self.channels[1] = g1
-		if g2 is not None: self.channels[2] = g2
-		if b is not None: self.channels[3] = b
+		buf, offset = self.color_buffer()
+		if r is not None: buf[offset] = int(r)
+		if g is not None: buf[offset+1] = buf[offset+2] = int(g)
+		if g1 is not None: buf[offset+1] = int(g1)
+		if g2 is not None: buf[offset+2] = int(g2)
+		if b is not None: buf[offset+3] = int(b)
 	
+	# set the color of all channels at once, used by the effects
+	def set_rgb(self, r, g, b):
+		buf, offset = self.color_buffer()
+		buf[offset] = r
+		buf[offset+1] = buf[offset+2] = g
+		buf[offset+3] = b
+
+	# the color was written into the frame, keep it while the LED is disabled
+	def color_written(self):
+		if self.saved_color is not None:
+			start = self.color_offset()
+			self.saved_color[:] = self.frame[start:start+LED_CHANNELS]
+			self.frame[start:start+LED_CHANNELS] = bytearray(LED_CHANNELS)
+
 	def get_color(self):
+		buf, offset = self.color_buffer()
 		return {
-			'r':self.channels[0], 
-			'g':self.channels[1],
-			'g2':self.channels[2],
-			'b':self.channels[3],
+			'r':buf[offset], 
+			'g':buf[offset+1],
+			'g2':buf[offset+2],
+			'b':buf[offset+3],
 		}
 
 	def set_current_limit(self, current_limit):
 		if current_limit is not self.current_limit:
 			self.current_limit = int(current_limit)
+			self.frame[self.limit_offset()] = self.convert_current_limit()
 			self.current_limit_update = True
 
 	# to make it easy to use the API, the interface uses values in mA. These
 	# values have to be converted into the values expected by the LED-Driver board.
 	# The led driver board expects decimal values between 0 and 255 that 
 	# are used to set the value of a digital resistor (AD5204) (0=10kOhm,255=45Ohm),
-	# which is used to set the current limit of the LED-Drivers
+	# which is used to set the current limit of the LED-Drivers. The conversion
+	# is a lookup in the calibration table of the LED channel.
 	def convert_current_limit(self):
-		r_ext = interpolate_resistor_value(self.current_limit)
-		return calculate_digital_resistor_input(r_ext)
+		return self.calibration.lookup(self.current_limit)
 	
 	def to_dict(self):
 		led_dict = {}
@@ -139,132 +230,658 @@ class RgbLed(object):
 		return led_dict
 
 
+# The register blocks of all controllers of the installation in one
+# contiguous buffer, block n holds the state of the controller with addr n.
+# Controllers and LEDs write into their block directly, so a frame is ready to
+# be sent without copying the state of the LEDs, and a register can be set for
+# the whole installation with a single slice assignment.
+class FrameBuffer(object):
+	__slots__ = ('blocks', 'block_size', 'buffer')
+
+	def __init__(self, blocks, block_size=RX_SIZE):
+		self.blocks = blocks
+		self.block_size = block_size
+		self.buffer = bytearray(blocks * block_size)
+
+	def offset(self, block):
+		return block * self.block_size
+
+	def block(self, block):
+		offset = self.offset(block)
+		return memoryview(self.buffer)[offset:offset+self.block_size]
+
+	# the value of a register in every block
+	def register(self, register):
+		return self.buffer[register::self.block_size]
+
+	# set a register in every block
+	def fill(self, register, value):
+		self.buffer[register::self.block_size] = bytearray([value]) * self.blocks
+
+
+# A register write to a controller board that is prepared once and reused for
+# every frame. load() copies a range of the controllers block in the frame
+# buffer into a preallocated transmit buffer, followed by the length byte that
+# the firmware uses to verify the transmission, and sets the length of the I2C
+# message accordingly. The messages refer to the transmit buffer directly, so
+# loading a new frame doesn't allocate buffers or messages.
+# By default the register address is set with a separate message, in register
+# write mode it is sent as the first byte of a single message.
+# A controller has at most one write in flight, so one RegisterWrite serves
+# all ranges of the controller.
+class RegisterWrite(object):
+	__slots__ = ('source', 'start', 'size', 'offset', 'data', 'register',
+			'transaction', 'message')
+
+	def __init__(self, address, source, register_writes=False):
+		self.source = memoryview(source)
+		self.start = 0
+		self.size = 0
+		self.data = bytearray(len(self.source) + 2)
+		if register_writes:
+			self.offset = 1
+			self.register = self.data
+			self.transaction = i2c.I2CTransaction(
+				i2c.writing_from(address, self.data))
+		else:
+			self.offset = 0
+			self.register = bytearray(1)
+			self.transaction = i2c.I2CTransaction(
+				i2c.writing_from(address, self.register),
+				i2c.writing_from(address, self.data))
+		self.message = self.transaction.msgs[self.transaction.nmsgs-1]
+
+	# copy the current values of a register range into the transmit buffer
+	def load(self, register, size):
+		self.start = register
+		self.size = size
+		self.register[0] = register
+		self.data[self.offset:self.offset+size] = self.source[register:register+size]
+		length = self.offset + size + 1
+		self.data[length-1] = length
+		self.message.len = length
+		return self.transaction
+
+	# True if the last loaded range includes the given register
+	def includes(self, register):
+		return self.start <= register < self.start + self.size
+
+	# the loaded value of a register of the last loaded range
+	def value(self, register):
+		return self.data[self.offset+register-self.start]
+
+	# store the loaded register values in the given copy of the buffer
+	def written(self, sent):
+		sent[self.start:self.start+self.size] = self.data[self.offset:self.offset+self.size]
+
+
+# A read of the status block from the txbuffer of a controller board, prepared
+# once like the RegisterWrite: a combined transaction that sets the register
+# address and reads the block into a preallocated buffer
+class StatusRead(object):
+	__slots__ = ('register', 'data', 'transaction')
+
+	def __init__(self, address, register=TX_CURRENT_LIMIT, size=TX_SIZE):
+		self.register = bytearray([register])
+		self.data = bytearray(size)
+		self.transaction = i2c.I2CTransaction(
+			i2c.writing_from(address, self.register),
+			i2c.reading_into(address, self.data))
+
+
+# The last known status of a controller board, as reported by its firmware.
+# It is updated by the telemetry poller and served without bus access.
+class ControllerStatus(object):
+	__slots__ = ('current_limits', 'message_cnt', 'message', 'updated', 'errors')
+
+	def __init__(self):
+		self.current_limits = []
+		self.message_cnt = 0
+		self.message = bytearray()
+		self.updated = None
+		self.errors = 0
+
+	def update(self, data):
+		self.current_limits = list(data[TX_CURRENT_LIMIT:TX_CURRENT_LIMIT+LED_CNT])
+		self.message_cnt = data[TX_MESSAGE_CNT]
+		self.message = data[TX_MESSAGE:]
+		self.updated = time.time()
+
+	def to_dict(self):
+		return {
+			'current_limits': self.current_limits,
+			'message_cnt': self.message_cnt,
+			'message': [b for b in self.message],
+			'updated': self.updated,
+			'errors': self.errors
+		}
+
+
+# The controller is identified in the installation (and the RESTful API) by
+# addr, which is its I2C address unless a different address is passed.
+# Its state lives in block addr of the frame buffer of the installation, a
+# controller without frame buffer gets a buffer of its own.
+# Before a write the state is rendered into the output buffer, the colors (or
+# the calibrated colors of the installation, if passed) are converted by the
+# color pipeline (gamma correction and quantization to the
+# PWM levels of the firmware). The controller keeps a copy of the output that
+# was written successfully and only writes the ranges (colors, current limits,
+# brightness) that changed since, or the complete state if several ranges
+# changed or the board may have lost its state.
 class RgbController(object):
-	def __init__(self, address, name, led_cnt = LED_CNT):
+	__slots__ = ('i2c_address', 'addr', 'name', 'frame', 'offset', 'i2c_buffer',
+			'sent', 'unsynced', 'led_cnt', 'leds', 'calibration', 'bus_id', 'bus',
+			'online', 'write_future', 'health', 'status', 'status_read',
+			'register_writes', 'write', 'output', 'pipeline', 'colors')
+
+	def __init__(self, address, name, led_cnt = LED_CNT,
+			register_writes = REGISTER_WRITES, bus = i2c.default_bus, addr = None,
+			calibration = None, frame = None, pipeline = None, colors = None):
 		self.i2c_address = address
+		self.addr = address if addr is None else addr
 		self.name = name
-		self.brightness = 0
-		self.i2c_buffer = bytearray(RX_SIZE)
+		if frame is None:
+			frame, block = FrameBuffer(1), 0
+		else:
+			block = self.addr
+		self.frame = frame.buffer
+		self.offset = frame.offset(block)
+		self.i2c_buffer = frame.block(block)
+		self.colors = colors if colors is not None else self.i2c_buffer
+		self.output = bytearray(RX_SIZE)
+		self.pipeline = pipeline if pipeline is not None else default_pipeline
+		self.sent = bytearray(RX_SIZE)
+		self.unsynced = True
 		self.led_cnt = led_cnt
 		self.leds = []
+		self.calibration = calibration if calibration is not None else Calibration()
+		self.bus_id = bus
+		self.bus = i2c.session(bus)
+		self.online = True
+		self.write_future = None
+		self.health = ControllerHealth()
+		self.status = ControllerStatus()
+		self.status_read = StatusRead(address)
+		self.register_writes = register_writes
+		self.write = RegisterWrite(address, self.output, register_writes)
 		self.create_leds()
 
 	def create_leds(self):
 		for idx in range(self.led_cnt):
-			self.leds.append(RgbLed(self.i2c_address, idx))
+			self.leds.append(RgbLed(self.addr, idx,
+					calibration=self.calibration.table(self.addr, idx),
+					frame=self.frame, offset=self.offset))
 
 	def get_led(self, index):
 		return self.leds[index]
 		
+	@property
+	def brightness(self):
+		return self.frame[self.offset+RX_BRIGHTNESS]
+
+	@brightness.setter
+	def brightness(self, brightness):
+		self.frame[self.offset+RX_BRIGHTNESS] = int(brightness)
+
 	def set_brightness(self, brightness):
 		self.brightness = brightness
-		self.i2c_buffer[RX_BRIGHTNESS] = brightness
 	
-	def update_i2c_buffer(self):
-		for idx in range(len(self.leds)):
-				led = self.leds[idx]
-				self.i2c_buffer[idx*LED_CHANNELS] = int(led.channels[0] if led.enabled else 0)
-				self.i2c_buffer[idx*LED_CHANNELS+1] = int(led.channels[1] if led.enabled else 0)
-				self.i2c_buffer[idx*LED_CHANNELS+2] = int(led.channels[2] if led.enabled else 0)
-				self.i2c_buffer[idx*LED_CHANNELS+3] = int(led.channels[3] if led.enabled else 0)
-				self.i2c_buffer[RX_CURRENT_LIMIT+idx] = int(led.convert_current_limit())
-				if (led.current_limit_update):
-					self.i2c_buffer[RX_CURRENT_UPDATE] = 0x01
-					led.current_limit_update = False;
-				self.i2c_buffer[RX_BRIGHTNESS] = int(self.brightness)
+	# the current limit update flag is set until a changed current limit was
+	# written successfully, the firmware applies the limits and stores them in
+	# the EEPROM whenever it receives the flag
+	@property
+	def limit_update(self):
+		return self.frame[self.offset+RX_CURRENT_UPDATE] != 0x00
+
+	@limit_update.setter
+	def limit_update(self, update):
+		self.frame[self.offset+RX_CURRENT_UPDATE] = 0x01 if update else 0x00
 
 	def get_state(self):
 		return self.i2c_buffer
+
+	# copy the registers of a binary frame record (starting at start of data)
+	# into the state: the colors and the brightness as they are, the current
+	# limits as digital resistor inputs, clamped to the input of the highest
+	# current of the calibration like the limits of the API; changed limits
+	# are flagged for the update and converted to mA for the API
+	def ingest(self, data, start):
+		frame, offset = self.frame, self.offset
+		# the index of register 0 in data
+		base = start - RX_RGB_LED
+		register, size = COLOR_RANGE
+		frame[offset+register:offset+register+size] = data[base+register:base+register+size]
+		frame[offset+RX_BRIGHTNESS] = data[base+RX_BRIGHTNESS]
+		for led in self.leds:
+			if led.saved_color is not None:
+				led.color_written()
+		if (data[base+RX_CURRENT_LIMIT:base+RX_CURRENT_UPDATE] ==
+				frame[offset+RX_CURRENT_LIMIT:offset+RX_CURRENT_UPDATE]):
+			return
+		for led in self.leds:
+			register = RX_CURRENT_LIMIT + led.channel
+			value = min(data[base+register],
+					led.calibration.lookup(led.calibration.max_current))
+			if frame[offset+register] != value:
+				frame[offset+register] = value
+				led.current_limit = led.calibration.current(value)
+				self.limit_update = True
+
+	# True if the last requested write of the state reached the hardware
+	def synced(self):
+		return self.write_future is None or self.write_future.done()
+
+	# write the complete state including the current limits, used when the
+	# board was (re)connected and may have lost its state
+	def resync(self):
+		self.limit_update = True
+		self.unsynced = True
+		self.update()
 	
 	def to_dict(self):
 		leds = []
 		for led  in self.leds:
 			leds.append(led.to_dict())
 		controller_dict = {
-				'addr': self.i2c_address, 
+				'addr': self.addr, 
+				'bus': self.bus_id,
+				'i2c_address': self.i2c_address,
 				'name': self.name, 
 				'brightness': self.brightness,
 				'led_cnt': self.led_cnt,
+				'online': self.online,
+				'synced': self.synced(),
+				'health': self.health.to_dict(),
 				'leds': leds
 			}
 
 		return controller_dict
 	
-	@retry(2, IOError, timeout=0.05)
+	# perform a transaction and record the result in the health of the
+	# controller, failures are raised to the caller
+	def perform(self, transaction):
+		try:
+			self.bus.perform(transaction)
+		except (IOError, OSError):
+			self.health.failed()
+			raise
+		self.health.succeeded()
+		self.written(transaction)
+
+	# convert the state in the frame buffer into the values sent to the board
+	def render_output(self):
+		self.output[:] = self.i2c_buffer
+		start, size = COLOR_RANGE
+		self.output[start:start+size] = self.colors[start:start+size]
+		self.output[start:start+size] = self.pipeline.convert(
+				self.output[start:start+size], self.addr)
+
+	# True if the output of a register range differs from the output that
+	# was written successfully
+	def changed(self, register, size):
+		return self.output[register:register+size] != self.sent[register:register+size]
+
+	# record the register values of a successfully performed transaction
+	def written(self, transaction):
+		write = self.write
+		write.written(self.sent)
+		if (write.start, write.size) == STATE_RANGE:
+			self.unsynced = False
+		# keep the flag if a current limit was changed in the meantime
+		if (self.writes_limits() and
+				self.i2c_buffer[RX_CURRENT_LIMIT:RX_CURRENT_UPDATE] ==
+				memoryview(self.sent)[RX_CURRENT_LIMIT:RX_CURRENT_UPDATE]):
+			self.limit_update = False
+
+	# True if the loaded write sets the current limit update flag, the
+	# firmware writes its EEPROM whenever it receives the flag, so the write
+	# must not be repeated
+	def writes_limits(self):
+		write = self.write
+		return write.includes(RX_CURRENT_UPDATE) and write.value(RX_CURRENT_UPDATE) != 0x00
+
 	def update_color(self):
-		self.update_i2c_buffer()
-		length = bytearray(1)
-		length[0] = 16 + 1
-		with i2c.I2CMaster() as bus:
-			bus.transaction(
-				i2c.writing_bytes(self.i2c_address, 0x00),
-				i2c.writing(self.i2c_address, self.i2c_buffer[0:16] + length))
-
-	@retry(2, IOError, timeout=0.05)
+		self.render_output()
+		self.perform(self.write.load(*COLOR_RANGE))
+
 	def update_limits(self):
-		self.update_i2c_buffer()
-		length = bytearray(1)
-		length[0] = 7 + 1
-		with i2c.I2CMaster() as bus:
-			bus.transaction(
-				i2c.writing_bytes(self.i2c_address, 0x10),
-				i2c.writing(self.i2c_address, self.i2c_buffer[16:23] + length))
-		
-	@retry(2, IOError, timeout=0.05)
+		self.render_output()
+		self.perform(self.write.load(*LIMITS_RANGE))
+
+	# the register ranges required to bring the board up to date, the complete
+	# state if several ranges changed
+	def dirty_ranges(self):
+		if self.unsynced:
+			return [STATE_RANGE]
+		dirty = []
+		if self.changed(*COLOR_RANGE):
+			dirty.append(COLOR_RANGE)
+		if self.limit_update:
+			dirty.append(LIMITS_RANGE)
+		if self.changed(*BRIGHTNESS_RANGE):
+			dirty.append(BRIGHTNESS_RANGE)
+		if len(dirty) > 1:
+			return [STATE_RANGE]
+		return dirty
+
+	# True if the board is not up to date with the state
+	def pending(self):
+		self.render_output()
+		return bool(self.dirty_ranges())
+
+	# return the transactions that write the ranges that changed since the
+	# last successful write, empty if nothing changed
+	def prepare_update(self):
+		self.render_output()
+		return [self.write.load(*register_range) for register_range in self.dirty_ranges()]
+
 	def update(self):
-		self.update_i2c_buffer()
-		length = bytearray(1)
-		length[0] = 23 + 1
-		with i2c.I2CMaster() as bus:
-			bus.transaction(
-				i2c.writing_bytes(self.i2c_address, 0x00),
-				i2c.writing(self.i2c_address, self.i2c_buffer[0:23] + length))
+		for transaction in self.prepare_update():
+			self.perform(transaction)
+
+
 
+# read count bytes from the txbuffer of a controller, starting at source
+def read(address, source, count, bus = i2c.default_bus):
+	result = i2c.session(bus).transaction(
+		i2c.writing_bytes(address, source),
+		i2c.reading(address, count))
 
+	return result[0]
 
-@retry(2, IOError, timeout = 0.05)
-def read(source, count):
-	with i2c.I2CMaster() as bus:
-		print("reading %d bytes from %02x" % (count, source))
-		result = bus.transaction(
-			i2c.writing_bytes(I2C_SLAVE_ADDRESS, source),
-			i2c.reading(I2C_SLAVE_ADDRESS, count))
 
-		return result[0]
+# the index of the controller addresses of a bus: the bus number, except that
+# the default bus swaps with bus 0, so the controllers of a single bus keep
+# their I2C address as their address
+def bus_index(bus):
+	if bus == i2c.default_bus:
+		return 0
+	if bus == 0:
+		return i2c.default_bus
+	return bus
 
 
 class RgbCoordinator(object):
-	def __init__(self):
+	def __init__(self, buses=None, fps=FRAME_RATE, gamma=GAMMA, dithering=False,
+			store_delay=STORE_DELAY, journal=False):
 		self.controllers = {}
 		self.led_sets = {}
-		self.scan_i2c_bus()
+		# LED-Sets from the storage file whose controllers were not found yet
+		self.pending_led_sets = []
+		# held while a batch of changes is applied, so the frames (and
+		# the controllers found meanwhile) never see a partial batch
+		self.lock = threading.RLock()
+		# the version of the state served by the API and the resources that
+		# changed with every version, responses are cached per version
+		self.changes = ChangeLog()
+		self.calibration = Calibration.load()
+		self.pipeline = ColorPipeline(gamma, dithering=dithering)
+		# every I2C bus (adapter or mux channel) is driven by its own executor
+		# thread and scanned by its own discovery, so the buses work in parallel
+		self.buses = buses if buses else [i2c.default_bus]
+		# a register block for every controller address up to the last bus
+		self.frame = FrameBuffer(128 * (max(bus_index(bus) for bus in self.buses) + 1))
+		self.color_calibration = ColorCalibration(self.frame, gamma, LED_CNT, LED_CHANNELS)
+		self.executors = {}
+		self.discoveries = {}
+		for bus in self.buses:
+			self.executors[bus] = I2CExecutor(name='i2c-%d' % bus)
+			self.discoveries[bus] = ControllerDiscovery(
+					partial(self.controller_found, bus),
+					partial(self.controller_lost, bus),
+					bus=i2c.session(bus), executor=self.executors[bus],
+					alive=partial(self.controller_alive, bus))
+		self.telemetry = TelemetryPoller(self.request_status)
+		# changes through the API are written by the render loop
+		self.renderer = RenderLoop(self.render_frame, fps)
+		# changed LED-Sets are stored in the background
+		self.store = LedSetStore(self.led_set_snapshot, delay=store_delay, journal=journal)
 		self.restore_led_sets()
-		
+		self.store.start()
+		for bus in self.buses:
+			self.executors[bus].start()
+			self.discoveries[bus].start()
+		self.telemetry.start()
+		self.renderer.start()
+
+	# stop the background threads of all buses
+	def stop(self):
+		self.renderer.stop()
+		self.renderer.join()
+		self.store.stop()
+		self.store.join()
+		self.telemetry.stop()
+		self.telemetry.join()
+		for bus in self.buses:
+			self.discoveries[bus].stop()
+			self.discoveries[bus].join()
+		for bus in self.buses:
+			self.executors[bus].stop()
+			self.executors[bus].thread.join()
+
+	@property
+	def version(self):
+		return self.changes.version
+
+	# count a change of the state served by the API, changes is a list of the
+	# changed resources ((kind, key), see ChangeLog)
+	def next_version(self, changes=()):
+		self.changes.record(changes)
+
+	# count a change through the API and write it with the next frame
+	def state_changed(self, changes=()):
+		self.next_version(changes)
+		self.renderer.request()
+
+	# True if the writes of all controllers are complete
+	def synced(self):
+		return all(controller.synced() for controller in self.controllers.values())
 
+	# the address of a controller in the installation: the I2C address offset
+	# by 128 per bus index (see bus_index), so the address of a controller
+	# does not depend on the order of the configured buses
+	def controller_addr(self, bus, i2c_address):
+		return bus_index(bus) * 128 + i2c_address
+
+	# called by the discovery of a bus when a controller answers, either for
+	# the first time or after it was lost
+	def controller_found(self, bus, i2c_address):
+		with self.lock:
+			self.add_controller(bus, i2c_address)
+			self.next_version([('controller', self.controller_addr(bus, i2c_address))])
+
+	def add_controller(self, bus, i2c_address):
+		addr = self.controller_addr(bus, i2c_address)
+		if addr not in self.controllers:
+			self.calibrate_colors(addr)
+			colors = None
+			if self.color_calibration.active:
+				colors = self.color_calibration.block(addr)
+			self.controllers[addr] = RgbController(i2c_address,
+					"Controller"+str(addr), bus=bus, addr=addr,
+					calibration=self.calibration, frame=self.frame,
+					pipeline=self.pipeline, colors=colors)
+			print("found controller %d on bus %d" % (addr, bus))
+			self.restore_pending_led_sets()
+			return
+		controller = self.controllers[addr]
+		controller.online = True
+		controller.health.reset()
+		print("controller %d is back online" % addr)
+		controller.write_future = self.executors[bus].submit(controller.resync,
+				key=('resync', addr))
+
+	# set the color calibration of the LEDs of a controller from the
+	# calibration profiles
+	def calibrate_colors(self, addr):
+		for idx in range(LED_CNT):
+			try:
+				self.color_calibration.set_led(addr, idx, *self.calibration.color(addr, idx))
+			except (ValueError, TypeError) as e:
+				print(e, "invalid color calibration of controller %d LED %d" % (addr, idx))
+
+	# True if a write to a controller succeeded recently, the discovery of
+	# its bus doesn't have to probe it
+	def controller_alive(self, bus, i2c_address):
+		controller = self.controllers.get(self.controller_addr(bus, i2c_address))
+		return controller is not None and controller.health.alive()
+
+	# called by the discovery of a bus when a controller stopped answering
+	def controller_lost(self, bus, i2c_address):
+		addr = self.controller_addr(bus, i2c_address)
+		if addr in self.controllers:
+			self.controllers[addr].online = False
+			self.next_version([('controller', addr)])
+			print("controller %d is offline" % addr)
+
+	# write the changes of all controllers of a bus, the transactions are
+	# combined into as few I2C transfers as possible. Controllers without
+	# changes and controllers whose circuit breaker is open are skipped,
+	# failures are counted in their health. The changes that were not
+	# written are retried with a later frame: with the next one after a
+	# failure, when the breaker lets the next write through if it is open
+	def update_bus(self, bus):
+		updates = []
+		retries = []
+		now = time.time()
+		with self.lock:
+			for controller in list(self.controllers.values()):
+				if not controller.online or controller.bus_id != bus:
+					continue
+				if controller.health.allow(now):
+					transactions = controller.prepare_update()
+					if transactions:
+						updates.append((transactions, controller))
+				elif controller.pending():
+					retries.append(controller.health.retry_at)
+		if updates:
+			retries += self.write_updates(bus, updates, now)
+		if retries:
+			self.renderer.request_at(min(retries))
+
+	# perform the prepared transactions of the controllers of a bus and
+	# record the results, returns the times at which the failed writes
+	# should be retried
+	def write_updates(self, bus, updates, now):
+		failed = dict(i2c.session(bus).perform_batch(
+				[transaction for transactions, _ in updates for transaction in transactions],
+				once=[transaction for transactions, controller in updates
+						if controller.writes_limits() for transaction in transactions]))
+		changes = []
+		retries = []
+		for transactions, controller in updates:
+			if any(transaction in failed for transaction in transactions):
+				controller.health.failed(now)
+				changes.append(('controller', controller.addr))
+				retries.append(controller.health.retry_at
+						if controller.health.state == OPEN else now)
+			else:
+				if controller.health.consecutive_failures:
+					changes.append(('controller', controller.addr))
+				controller.health.succeeded(now)
+			for transaction in transactions:
+				if transaction not in failed:
+					controller.written(transaction)
+		# the health of the controllers changed
+		if changes:
+			self.next_version(changes)
+		return retries
+
+	# write the state of all controllers, one bus after the other
 	def update_controllers(self):
+		for bus in self.buses:
+			self.update_bus(bus)
+
+	# queue a write of all controllers on the executors of their buses and
+	# return without waiting, requests that arrive before the write of a bus
+	# started are merged into it
+	def request_update(self):
+		futures = {}
+		for bus in self.buses:
+			futures[bus] = self.executors[bus].submit(self.update_bus, bus, key='frame')
+		for controller in self.controllers.values():
+			if controller.bus_id in futures:
+				controller.write_future = futures[controller.bus_id]
+		return futures
+
+	# called by the render loop for every frame: advances the effects of the
+	# LED-Sets, calibrates the colors of the installation and writes the
+	# changes, while effects are running (or the output is dithered) the next
+	# frame is requested right away
+	def render_frame(self):
+		now = time.time()
+		self.pipeline.advance()
+		effects = []
+		with self.lock:
+			for led_set in list(self.led_sets.values()):
+				if led_set.effect is not None:
+					led_set.effect.apply(now, led_set.leds)
+					effects.append(('led_set', led_set.name))
+			# the effects changed the colors of the LEDs of their sets
+			if effects:
+				self.next_version(effects)
+			if self.color_calibration.active:
+				self.color_calibration.render()
+		if effects or self.pipeline.dithering:
+			self.renderer.request()
+		return self.request_update()
+
+	# read the status blocks of all controllers of a bus into their cached
+	# status, the reads are combined into as few I2C transfers as possible
+	def read_status(self, bus):
+		reads = []
 		for controller in self.controllers.values():
-			controller.update()
+			if (controller.online and controller.bus_id == bus and
+					controller.health.state == CLOSED):
+				reads.append((controller.status_read.transaction, controller))
+		if not reads:
+			return
+		failed = dict(i2c.session(bus).perform_batch([transaction for transaction, _ in reads]))
+		for transaction, controller in reads:
+			if transaction in failed:
+				controller.status.errors += 1
+			else:
+				controller.status.update(controller.status_read.data)
+
+	# queue a status read of all controllers with a priority below frames
+	def request_status(self):
+		for bus in self.buses:
+			self.executors[bus].submit(self.read_status, bus,
+					priority=PRIORITY_TELEMETRY, key='status')
 
 	def scan_i2c_bus(self):
 		'''
-		scan a range of the I2C bus in order to find new RGBControllers,
-		skip known addresses,
-		add newly found RGBControllers to the local list
+		scan the complete range of all I2C buses at once in order to find new
+		RGBControllers, the discovery threads scan the buses continuously,
+		newly found RGBControllers are added to the local list
 		'''
-		controllers = []
-		for addr in range(5, 127, 1):
-			if addr not in self.controllers.keys():
-				try:
-					with i2c.I2CMaster() as bus:
-						bus.transaction(
-							i2c.writing_bytes(addr, 0x00))
-					controllers.append(addr)
-				except Exception as e:
-					None
-					# no controller for this address
-		for addr in controllers:
-			self.controllers[addr] = RgbController(addr, "Controller"+str(addr))
-		pprint(controllers)
+		for bus in self.buses:
+			self.discoveries[bus].scan()
+		pprint(sorted(self.controllers.keys()))
+
+	# the controllers, LEDs and LED-Sets that changed after version since,
+	# the names of removed LED-Sets, and the current version. If the changes
+	# since are no longer known, resync is set and the complete state has to
+	# be fetched
+	def get_changes(self, since):
+		changes_json = {'controller': [], 'led': [], 'led_set': [], 'removed_led_set': []}
+		with self.lock:
+			version = self.version
+			changes = self.changes.since(since)
+			if changes is None:
+				return {'version': version, 'resync': True}
+			for kind, key in changes:
+				if kind == 'controller' and key in self.controllers:
+					changes_json['controller'].append(self.controllers[key].to_dict())
+				elif kind == 'led' and key[0] in self.controllers:
+					changes_json['led'].append(self.controllers[key[0]].get_led(key[1]).to_dict())
+				elif kind == 'led_set' and key in self.led_sets:
+					changes_json['led_set'].append(self.led_sets[key].to_dict())
+				elif kind == 'led_set':
+					changes_json['removed_led_set'].append(key)
+		changes_json['version'] = version
+		changes_json['resync'] = False
+		return changes_json
 
 	# create a list of controllers that can be jsonified for the RESTful API
 	def get_controllers(self):
@@ -279,10 +896,21 @@ class RgbCoordinator(object):
 			raise HttpError('No controller with given address', 404)
 		return self.controllers[address].to_dict()
 
+	# the cached status of a controller as read by the telemetry poller
+	def get_controller_status(self, address):
+		if address not in self.controllers:
+			raise HttpError('No controller with given address', 404)
+		status = self.controllers[address].status.to_dict()
+		status['addr'] = address
+		return status
+
+	def get_controller_statuses(self):
+		return [self.get_controller_status(address) for address in self.controllers.keys()]
+
 	def update_controller(self, controller_json, address):
 		verify_rgb_controller_json(controller_json)
 		# verify that the update doesn't change constant values
-		if address is not controller_json['addr']:
+		if address != controller_json['addr']:
 			raise HttpError('Address change not possible via API', 409)
 		if controller_json['led_cnt'] != LED_CNT:
 			raise HttpError('LED count change not possible via API', 409)
@@ -297,15 +925,112 @@ class RgbCoordinator(object):
 		# TODO: should it be possible to change color values and set information
 		# via the controller API? Only Leds that are not part of a set ?
 		# update the led information
+		leds = []
 		if 'leds' in controller_json:
 			for led_json in controller_json['leds']:
 				verify_rgb_led_json(led_json)
 				if 'color' in led_json:
-					self.update_led_color(led_json)
+					led = self.identify_led(led_json)
+					self.update_led_color(led_json, led)
+					leds.append(led)
 		
-		controller.update() #Todo: remove
+		self.state_changed([('controller', address)] + led_changes(leds))
 		return controller.to_dict()
 
+	# change only the given fields of a controller (name, brightness and the
+	# color and current limit of the LEDs given by channel), returns the
+	# changed fields
+	def patch_controller(self, controller_json, address):
+		if address not in self.controllers:
+			raise HttpError('No controller with given address', 404)
+		controller = self.controllers[address]
+		verify_patch_json(controller_json)
+		if controller_json.get('addr', address) != address:
+			raise HttpError('Address change not possible via API', 409)
+		if controller_json.get('led_cnt', controller.led_cnt) != controller.led_cnt:
+			raise HttpError('LED count change not possible via API', 409)
+		# verify all fields before anything is changed
+		leds = [(self.patch_led_channel(controller, led_json), verify_led_patch(led_json))
+				for led_json in controller_json.get('leds', [])]
+		if 'brightness' in controller_json:
+			brightness = verify_int(controller_json['brightness'], 0, 255,
+					'Brightness has to be 0-255')
+		if 'name' in controller_json:
+			verify_name(controller_json['name'])
+
+		delta = {'addr': address}
+		if 'name' in controller_json:
+			controller.name = delta['name'] = controller_json['name']
+		if 'brightness' in controller_json:
+			controller.brightness = delta['brightness'] = brightness
+		if leds:
+			delta['leds'] = [self.patch_led(led, led_patch) for led, led_patch in leds]
+		self.state_changed([('controller', address)] +
+				led_changes(led for led, _ in leds))
+		return delta
+
+	# the LED of a controller addressed by the channel of a LED patch
+	def patch_led_channel(self, controller, led_json):
+		if not isinstance(led_json, dict) or 'channel' not in led_json:
+			raise HttpError('Incomplete data set', 409)
+		channel = verify_int(led_json['channel'], 0, controller.led_cnt - 1,
+				'LED channel out of range')
+		return controller.get_led(channel)
+
+	# change the color and the current limit of a LED if given (a patch
+	# verified by verify_led_patch), returns the changed fields
+	def patch_led(self, led, led_patch):
+		delta = {'controller': led.master_addr, 'channel': led.channel}
+		if 'color' in led_patch:
+			led.set_color(led_patch['color'])
+			delta['color'] = led.get_color()
+		if 'current_limit' in led_patch:
+			led.set_current_limit(led_patch['current_limit'])
+			delta['current_limit'] = led.current_limit
+		return delta
+
+	# set the color of a LED, the compact update of the live channel
+	def set_led_rgb(self, address, channel, r, g, b):
+		if address not in self.controllers:
+			raise HttpError('No controller with given address', 404)
+		led = self.patch_led_channel(self.controllers[address], {'channel': channel})
+		led.set_rgb(*verify_rgb(r, g, b))
+		# the colors of the LEDs of a set are stored with the set
+		if led.led_set in self.led_sets:
+			self.store_led_sets(led.led_set)
+		self.state_changed(led_changes([led]))
+
+	# set the color of all LEDs of a LED-Set
+	def set_led_set_rgb(self, led_set_name, r, g, b):
+		if led_set_name not in self.led_sets:
+			raise HttpError('No led-set with given name exists', 404)
+		r, g, b = verify_rgb(r, g, b)
+		leds = self.led_sets[led_set_name].leds
+		for led in leds:
+			led.set_rgb(r, g, b)
+		self.store_led_sets(led_set_name)
+		self.state_changed(led_changes(leds))
+
+	# copy a binary frame (see FRAME_RECORD_SIZE) into the state of the
+	# controllers, all records are checked before any of them is copied.
+	# Returns the number of controllers
+	def ingest_frame(self, data):
+		if len(data) % FRAME_RECORD_SIZE:
+			raise HttpError('Frame records have to be %d bytes' % FRAME_RECORD_SIZE, 409)
+		data = bytearray(data)
+		records = []
+		for start in range(0, len(data), FRAME_RECORD_SIZE):
+			addr = FRAME_RECORD_ADDR.unpack_from(data, start)[0]
+			if addr not in self.controllers:
+				raise HttpError('No controller with given address', 404)
+			records.append((self.controllers[addr], start + FRAME_RECORD_ADDR.size))
+		with self.lock:
+			for controller, start in records:
+				controller.ingest(data, start)
+			self.state_changed([('controller', controller.addr)
+					for controller, _ in records])
+		return len(records)
+
 	def get_led_sets(self):
 		led_set_list = []
 		for led_set in self.led_sets.values():
@@ -326,6 +1051,10 @@ class RgbCoordinator(object):
 		# check if all leds of the Led set are available
 		for led_json in led_set_json['leds']:
 			self.identify_led(led_json)
+		# the effect of a stored LED-Set
+		effect = None
+		if led_set_json.get('effect'):
+			effect = self.create_effect(led_set_json['effect'])
 			
 		# create the new led_set and register the leds
 		led_set = RgbLedSet(led_set_json['name'])
@@ -336,11 +1065,12 @@ class RgbCoordinator(object):
 				self.update_led_color(led_json, led)
 		# set the status of the LED-Set and the associated LEDs (on/off)
 		led_set.set_status(led_set_json['status'])
+		led_set.effect = effect
 		
 		# add the new LED-Set to the coordinator and store it
 		self.led_sets[led_set.name] = led_set
-		self.store_led_sets()
-		self.update_controllers() #TODO: remove
+		self.store_led_sets(led_set.name)
+		self.state_changed([('led_set', led_set.name)] + led_changes(led_set.leds))
 		return self.get_led_set(led_set.name)
 	
 	def update_led_set(self, led_set_json, led_set_name):
@@ -351,6 +1081,7 @@ class RgbCoordinator(object):
 
 		# check if new leds were added to the set and update values of all leds
 		led_set = self.led_sets[led_set_name]
+		previous_leds = list(led_set.leds)
 		tmp_led_list = []
 		for led_json in led_set_json['leds']:
 			led = self.identify_led(led_json)
@@ -366,7 +1097,7 @@ class RgbCoordinator(object):
 		# check if leds were removed from the set
 		for led in set(led_set.leds).difference(tmp_led_list):
 			led_set.remove_led(led)
-			led.set_name = 'none'
+			led.led_set = 'none'
 		
 		# check if the name of the LED-Set was changed
 		if (led_set_name != led_set_json['name']):
@@ -376,10 +1107,65 @@ class RgbCoordinator(object):
 			led_set.set_name(led_set_json['name'])
 			self.led_sets[led_set.name] = led_set
 		
-		self.store_led_sets()
-		self.update_controllers() #TODO: remove
+		self.store_led_sets(led_set_name, led_set.name)
+		changes = [('led_set', led_set_name)]
+		if led_set.name != led_set_name:
+			changes.append(('led_set', led_set.name))
+		self.state_changed(changes + led_changes(previous_leds + led_set.leds))
 		return led_set.to_dict()
 	
+	# change only the given fields of a LED-Set: name, status, the color or
+	# current limit of all its LEDs, or of single LEDs of the set (given by
+	# controller and channel), returns the changed fields
+	def patch_led_set(self, led_set_json, led_set_name):
+		if led_set_name not in self.led_sets:
+			raise HttpError('No led-set with given name exists', 404)
+		led_set = self.led_sets[led_set_name]
+		verify_patch_json(led_set_json)
+		new_name = verify_name(led_set_json.get('name', led_set_name))
+		if new_name != led_set_name and new_name in self.led_sets:
+			raise HttpError('Name already exists', 409)
+		# verify all fields before anything is changed
+		set_patch = verify_led_patch(led_set_json)
+		leds = []
+		for led_json in led_set_json.get('leds', []):
+			if not isinstance(led_json, dict) or 'controller' not in led_json:
+				raise HttpError('Incomplete data set', 409)
+			address = verify_int(led_json['controller'], 0, None, 'Invalid controller address')
+			if address not in self.controllers:
+				raise HttpError('No controller with given address', 404)
+			led = self.patch_led_channel(self.controllers[address], led_json)
+			if led not in led_set.leds:
+				raise HttpError('LED is not part of the LED-Set', 409)
+			leds.append((led, verify_led_patch(led_json)))
+
+		delta = {'name': new_name}
+		if new_name != led_set_name:
+			del self.led_sets[led_set_name]
+			led_set.set_name(new_name)
+			self.led_sets[new_name] = led_set
+		if 'status' in led_set_json:
+			led_set.set_status(led_set_json['status'])
+			delta['status'] = led_set.status
+		# the color and current limit of the set apply to all its LEDs
+		if set_patch:
+			leds = [(led, set_patch) for led in led_set.leds] + leds
+		if leds:
+			led_deltas = {}
+			for led, led_patch in leds:
+				led_deltas.setdefault((led.master_addr, led.channel), {}).update(
+						self.patch_led(led, led_patch))
+			delta['leds'] = [led_deltas[key] for key in sorted(led_deltas)]
+		self.store_led_sets(led_set_name, new_name)
+		changes = [('led_set', led_set_name)]
+		if new_name != led_set_name:
+			# the LEDs refer to their set by name
+			changes += [('led_set', new_name)] + led_changes(led_set.leds)
+		else:
+			changes += led_changes(led for led, _ in leds)
+		self.state_changed(changes)
+		return delta
+
 	def remove_led_set(self, led_set_name):
 		# check if a led_set with the given name exists
 		if led_set_name not in self.led_sets:
@@ -389,31 +1175,163 @@ class RgbCoordinator(object):
 		led_set.set_name('none')
 		# TODO: LEDs should be switched off when Set is removed
 		del self.led_sets[led_set_name]
-		self.store_led_sets()
+		self.store_led_sets(led_set_name)
+		self.next_version([('led_set', led_set_name)] + led_changes(led_set.leds))
 	
-	# stores the current led sets and their status in a file
-	def store_led_sets(self):
-		with io.open('led_set.json', 'w', encoding='utf-8') as led_set_file:
-			if (len(self.led_sets) > 0):
-				led_set_file.write(json.dumps(self.get_led_sets(),  ensure_ascii=False))
-			else:
-				led_set_file.write(u"")
+	def get_effect(self, led_set_name):
+		if led_set_name not in self.led_sets:
+			raise HttpError('No led-set with given name exists', 404)
+		effect = self.led_sets[led_set_name].effect
+		return effect.to_dict() if effect is not None else {'effect': None}
+
+	# start an effect on a LED-Set or change its parameters, the colors are
+	# computed by the render loop for every frame
+	def start_effect(self, led_set_name, effect_json):
+		if led_set_name not in self.led_sets:
+			raise HttpError('No led-set with given name exists', 404)
+		led_set = self.led_sets[led_set_name]
+		led_set.effect = self.create_effect(effect_json)
+		self.store_led_sets(led_set_name)
+		self.state_changed([('led_set', led_set_name)])
+		return led_set.effect.to_dict()
+
+	# stop the effect of a LED-Set, the LEDs keep their current colors
+	def stop_effect(self, led_set_name):
+		if led_set_name not in self.led_sets:
+			raise HttpError('No led-set with given name exists', 404)
+		self.led_sets[led_set_name].effect = None
+		self.store_led_sets(led_set_name)
+		self.next_version([('led_set', led_set_name)])
+
+	def create_effect(self, effect_json):
+		try:
+			return create_effect(effect_json)
+		except (ValueError, AttributeError) as e:
+			raise HttpError('Invalid effect: %s' % e, 409)
+
+	# apply a list of changes of controllers and LED-Sets at once, every change
+	# is a request of the controller or LED-Set API:
+	#
+	# {"changes": [{"method": "PUT", "controller": 33, "data": {...}},
+	#              {"method": "POST", "led_set": null, "data": {...}},
+	#              {"method": "PUT", "led_set": "name", "data": {...}},
+	#              {"method": "PATCH", "led_set": "name", "data": {"status": "off"}},
+	#              {"method": "DELETE", "led_set": "name"}]}
+	#
+	# The changes are applied in order and all or none of them: if a change
+	# fails, the state before the batch is restored and its error is raised.
+	# The LED-Sets are stored once and the changes are written with one frame.
+	def apply_changes(self, changes_json):
+		verify_changes_json(changes_json)
+		changes_json = changes_json['changes']
+		results = []
+		with self.lock:
+			state = self.save_state()
+			try:
+				for change in changes_json:
+					results.append(self.apply_change(change))
+			except Exception:
+				self.restore_state(state)
+				# the clients have to fetch the restored state
+				self.changes.reset()
+				raise
+		self.state_changed()
+		return results
+
+	def apply_change(self, change):
+		method, data = change['method'], change.get('data')
+		if 'controller' in change:
+			if method == 'PATCH':
+				return self.patch_controller(data, int(change['controller']))
+			if method != 'PUT':
+				raise HttpError('Method not supported for controllers', 405)
+			return self.update_controller(data, int(change['controller']))
+		if method == 'PATCH':
+			return self.patch_led_set(data, change['led_set'])
+		if method == 'POST':
+			return self.add_led_set(data)
+		if method == 'PUT':
+			return self.update_led_set(data, change['led_set'])
+		if method == 'DELETE':
+			self.remove_led_set(change['led_set'])
+			return None
+		raise HttpError('Method not supported for LED-Sets', 405)
+
+	# the state changed by the API, restored if a batch of changes fails
+	def save_state(self):
+		leds = []
+		for controller in self.controllers.values():
+			for led in controller.leds:
+				saved_color = bytearray(led.saved_color) if led.saved_color is not None else None
+				leds.append((led, led.led_set, saved_color, led.current_limit))
+		return {
+			'frame': bytearray(self.frame.buffer),
+			'names': dict((addr, controller.name) for addr, controller in self.controllers.items()),
+			'leds': leds,
+			'led_sets': dict(self.led_sets),
+			'sets': [(led_set, list(led_set.leds), led_set.name, led_set.status, led_set.effect)
+					for led_set in self.led_sets.values()],
+			'pending_led_sets': list(self.pending_led_sets)
+		}
+
+	def restore_state(self, state):
+		self.frame.buffer[:] = state['frame']
+		for addr, name in state['names'].items():
+			self.controllers[addr].name = name
+		for led, led_set, saved_color, current_limit in state['leds']:
+			led.led_set = led_set
+			led.saved_color = saved_color
+			led.current_limit = current_limit
+		self.led_sets.clear()
+		self.led_sets.update(state['led_sets'])
+		for led_set, leds, name, status, effect in state['sets']:
+			led_set.leds[:] = leds
+			led_set.name = name
+			led_set.status = status
+			led_set.effect = effect
+		self.pending_led_sets[:] = state['pending_led_sets']
+
+	# stores the given LED-Sets (by name) with the next write of the store,
+	# which runs after the store delay, so the changes of a batch (or of
+	# several requests) are written at once
+	def store_led_sets(self, *names):
+		self.store.request(*names)
+
+	# the LED-Sets to store, called by the store (see LedSetStore): all
+	# LED-Sets including the pending ones if complete, and the stored
+	# representation of the given LED-Sets, None if removed
+	def led_set_snapshot(self, names, complete):
+		with self.lock:
+			led_sets = None
+			if complete:
+				led_sets = self.get_led_sets() + self.pending_led_sets
+			return led_sets, [(name, self.stored_led_set(name)) for name in names]
 
-	# tries to restore the led sets from the file
+	def stored_led_set(self, led_set_name):
+		if led_set_name in self.led_sets:
+			return self.led_sets[led_set_name].to_dict()
+		for led_set in self.pending_led_sets:
+			if led_set['name'] == led_set_name:
+				return led_set
+		return None
+
+	# tries to restore the led sets from the storage, sets with controllers
+	# that were not found yet are kept pending
 	def restore_led_sets(self):
-		if os.path.exists("led_set.json"):
-			with io.open('led_set.json', 'r', encoding='utf-8') as led_set_file:
-				try:
-					led_sets = json.loads(led_set_file.read())
-				except ValueError as e:
-					print(e, "LED-Set storage file empty or corrupted")
-					return
-				# if the file exists and could be parsed try to add the LED-Sets
-				for led_set in led_sets:
-					try:
-						self.add_led_set(led_set)
-					except HttpError as e:
-						print(e)
+		self.pending_led_sets = self.store.load()
+		self.restore_pending_led_sets()
+
+	# tries to add the pending LED-Sets, called when new controllers are found
+	def restore_pending_led_sets(self):
+		for led_set in list(self.pending_led_sets):
+			try:
+				self.pending_led_sets.remove(led_set)
+				self.add_led_set(led_set)
+			except HttpError as e:
+				if e.error_code == 404:
+					self.pending_led_sets.append(led_set)
+				else:
+					print(e)
 	
 	# update values of led instance
 	def update_led_color(self, led_json, led = None):
@@ -433,12 +1351,54 @@ class RgbCoordinator(object):
 		led = self.controllers[address].get_led(int(led_json['channel']))
 		return led
 
+# verify that the channels of a color are values 0-255
+def verify_rgb(*channels):
+	if not all(isinstance(value, int) and 0 <= value <= 255 for value in channels):
+		raise HttpError('Color channels have to be 0-255', 409)
+	return channels
+
+# convert a value of a request to an integer in the range low to high (no
+# limit if None)
+def verify_int(value, low, high, message):
+	try:
+		value = int(value)
+	except (ValueError, TypeError):
+		raise HttpError(message, 409)
+	if value < low or (high is not None and value > high):
+		raise HttpError(message, 409)
+	return value
+
+# a name of a request, which has to be a string
+def verify_name(name):
+	if not isinstance(name, basestring):
+		raise HttpError('Name has to be a string', 409)
+	return name
+
+# the color and the current limit of a LED patch, verified and converted
+def verify_led_patch(led_json):
+	led_patch = {}
+	if 'color' in led_json:
+		if not isinstance(led_json['color'], dict):
+			raise HttpError('Incomplete data set', 409)
+		led_patch['color'] = dict((key, verify_int(value, 0, 255, 'Color channels have to be 0-255'))
+				for key, value in led_json['color'].items()
+				if key in COLOR_KEYS and value is not None)
+	if 'current_limit' in led_json:
+		led_patch['current_limit'] = verify_int(led_json['current_limit'], 0, None,
+				'Current limit has to be a value in mA')
+	return led_patch
+
+# the change records of LEDs (see ChangeLog)
+def led_changes(leds):
+	return [('led', (led.master_addr, led.channel)) for led in leds]
+
 # verify the completeness of the controller update
 def verify_rgb_controller_json(controller_json):
 	keys = ['addr', 'brightness', 'name', 'led_cnt']
 	for key in keys:
 		if key not in controller_json:
 			raise HttpError('Incomplete data set', 409)
+	verify_name(controller_json['name'])
 
 # verify that the json representation of an RgbLed is complete
 def verify_rgb_led_json(led_json):
@@ -447,6 +1407,31 @@ def verify_rgb_led_json(led_json):
 			if key not in led_json:
 				raise HttpError('Incomplete data set', 409)
 
+# verify that a batch of changes is a list of complete changes of controllers
+# or LED-Sets
+def verify_changes_json(changes_json):
+	if not isinstance(changes_json, dict) or not isinstance(changes_json.get('changes'), list):
+		raise HttpError('Changes have to be a list', 409)
+	for change in changes_json['changes']:
+		if not isinstance(change, dict) or 'method' not in change:
+			raise HttpError('Incomplete data set', 409)
+		if ('controller' in change) == ('led_set' in change):
+			raise HttpError('Change has to address a controller or a LED-Set', 409)
+		if 'controller' in change:
+			verify_int(change['controller'], 0, None, 'Invalid controller address')
+		elif (change['led_set'] is not None and
+				not isinstance(change['led_set'], basestring)):
+			raise HttpError('Invalid LED-Set name', 409)
+		if change['method'] in ('PUT', 'POST', 'PATCH') and not isinstance(change.get('data'), dict):
+			raise HttpError('Incomplete data set', 409)
+
+# verify that a partial update is an object
+def verify_patch_json(patch_json):
+	if not isinstance(patch_json, dict):
+		raise HttpError('Incomplete data set', 409)
+	if 'leds' in patch_json and not isinstance(patch_json['leds'], list):
+		raise HttpError('LEDs have to be a list', 409)
+
 # verify that the json representation of an RgbLedSet is complete
 def verify_rgb_led_set_json(led_set_json):
 	keys = ['name', 'leds', 'status']
@@ -458,46 +1443,7 @@ def verify_rgb_led_set_json(led_set_json):
 				raise HttpError('Incomplete data set, no LEDs in Set', 409)
 			for led_json in led_set_json['leds']:
 				verify_rgb_led_json(led_json)
-
-# interpolates the resistor value for the R_ext input of an LED driver IC
-# based on values taken from STP04CM05 datasheet fig. 13
-# R_ext limits the current output of the IC.
-def interpolate_resistor_value(i_led):
-	# define a lookup table (lut) with the values from the datasheet. 
-	# read as: (Output current, External Resistor value)
-	table = [ (50, 1550),
-			(80, 950),
-			(100, 800),
-			(150, 500),
-			(350, 220),
-			(400, 200),
-			(500, 180) ]
-	# return with min/max values if the requested current exceeds the range
-	# of the lut
-	if (i_led < table[0][0]):
-		return table[0][1]
-	elif(i_led > table[-1][0]):
-		return table[-1][1]
-
-	# current is in range of lut
-	for idx in range(len(table)-1):
-		# check the lut for the correct period
-		if (i_led >= table[idx][0] and i_led <= table[idx+1][0]):
-			# interpolate a linear function between the two points
-			delta_r_ext = (table[idx+1][1] - table[idx][1])
-			delta_i_out = (table[idx+1][0] - table[idx][0])
-			m = float(delta_r_ext) / delta_i_out
-			n = table[idx][1] - m * table[idx][0]
-			return int(m*i_led +n)
-
-# the digital resistor has a range of 10kOhm divided into 256 discrete steps.
-# It is used to set the current limit of the LED driver IC
-# The formula for calculating the input value is derived from the datasheet
-def calculate_digital_resistor_input(r_ext):
-	# R_wa(D_x) = (256-D_x)/256 * R_ab + R_w => from digital input to Ohm
-	# D_x = (256 * (R_w+R_ab-R_wa)) / R_ab => from Ohm to digital input
-	d_x = int((256*(45+10000-r_ext))/10000)
-	return d_x
+	verify_name(led_set_json['name'])
 
 class HttpError(Exception):
 	def __init__(self, message, error_code):
@@ -541,7 +1487,7 @@ if __name__ == "__main__":
 				print(exc_type, fname, exc_tb.tb_lineno)
 		print(" ")
 
-	read_result = read(0x00, 32)
+	read_result = read(i2c_address, 0x00, 32)
 	print("read %d bytes" % len(read_result))
 	i = 0
 	for n in read_result:
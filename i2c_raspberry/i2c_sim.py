@@ -0,0 +1,190 @@
+#!/usr/bin/python
+""" Simulated I2C bus with emulated controller boards.
+
+    Replaces the I2C hardware for development and load tests without
+    controller boards: install() registers simulated buses and makes
+    i2c.session() open them instead of /dev/i2c-N, the rest of the
+    i2c_raspberry code runs unchanged.
+
+    For example:
+
+        import i2c_sim
+        i2c_sim.install({0: range(0x20, 0x30), 1: range(0x20, 0x30)})
+        coordinator = RgbCoordinator([0, 1]) """
+import os
+import time
+import errno
+import random
+import threading
+from ctypes import string_at, memmove
+
+import i2c as i2c
+from i2c_ctypes import *
+
+# layout of the controller buffers, see rgb-pcb/twislave_sm.h and rgb_pcb.ino
+BUFFER_SIZE = 32
+LED_COUNT = 4
+RX_CURRENT_LIMIT = 16
+RX_CURRENT_UPDATE = 20
+TX_CURRENT_LIMIT = 0
+
+# Emulates the TWI slave (rgb-pcb/twislave_sm.c) of a controller board and the
+# handling of received data in the main loop of the firmware (rgb_pcb.ino).
+class SimulatedController(object):
+	def __init__(self, address, register_writes=False):
+		self.address = address
+		self.register_writes = register_writes
+		self.rxbuffer = bytearray(BUFFER_SIZE)
+		self.txbuffer = bytearray(BUFFER_SIZE)
+		self.write_destination = 0
+		self.writes = 0
+		self.rejected = 0
+		self.limit_updates = 0
+
+	# a complete write transmission (terminated by a stop or repeated start)
+	def receive(self, data):
+		length = len(data)
+		if length == 1:
+			self.write_destination = data[0]
+		elif (self.register_writes and length > 2 and
+				data[0] + length - 2 <= BUFFER_SIZE and data[-1] == length):
+			self.write_destination = data[0]
+			self.rxbuffer[data[0]:data[0]+length-2] = data[1:length-1]
+			self.received()
+		elif (length > 1 and self.write_destination + length < BUFFER_SIZE and
+				data[-1] == length):
+			destination = self.write_destination
+			self.rxbuffer[destination:destination+length-1] = data[0:length-1]
+			self.write_destination += length
+			self.received()
+		else:
+			self.rejected += 1
+
+	# a read transmission, served from the txbuffer
+	def transmit(self, length):
+		if self.write_destination >= BUFFER_SIZE:
+			self.write_destination = 0
+		data = bytearray(length)
+		for idx in range(length):
+			if self.write_destination < BUFFER_SIZE:
+				data[idx] = self.txbuffer[self.write_destination]
+				self.write_destination += 1
+			else:
+				data[idx] = 0xFF
+		return data
+
+	def received(self):
+		self.writes += 1
+		if self.rxbuffer[RX_CURRENT_UPDATE] != 0x00:
+			self.txbuffer[TX_CURRENT_LIMIT:TX_CURRENT_LIMIT+LED_COUNT] = \
+				self.rxbuffer[RX_CURRENT_LIMIT:RX_CURRENT_LIMIT+LED_COUNT]
+			self.rxbuffer[RX_CURRENT_UPDATE] = 0x00
+			self.limit_updates += 1
+
+
+# Models the timing and the error behavior of one I2C bus. Every byte takes 9
+# clock cycles (8 data bits + ACK), every start / repeated start and the final
+# stop condition about one more. A message to an address without controller is
+# not acknowledged, which aborts the transfer like on the hardware. With
+# error_rate > 0 messages fail randomly. If realtime is set, a transfer blocks
+# the caller for the time it would occupy the bus.
+class SimulatedBus(object):
+	def __init__(self, clock=100000, error_rate=0.0, realtime=True):
+		self.clock = clock
+		self.error_rate = error_rate
+		self.realtime = realtime
+		self.controllers = {}
+		self.lock = threading.Lock()
+		self.transfers = 0
+		self.messages = 0
+		self.bytes = 0
+		self.errors = 0
+		self.busy_time = 0.0
+
+	def add(self, controller):
+		self.controllers[controller.address] = controller
+		return controller
+
+	def remove(self, address):
+		return self.controllers.pop(address, None)
+
+	# perform the messages of one I2C_RDWR ioctl
+	def transfer(self, msgs, nmsgs):
+		if nmsgs > I2C_RDWR_IOCTL_MAX_MSGS:
+			raise IOError(errno.EINVAL, os.strerror(errno.EINVAL))
+		with self.lock:
+			self.transfers += 1
+			bits = 1
+			try:
+				for idx in range(nmsgs):
+					msg = msgs[idx]
+					self.messages += 1
+					self.bytes += 1 + msg.len
+					bits += 1 + 9
+					controller = self.controllers.get(msg.addr)
+					if controller is None or random.random() < self.error_rate:
+						self.errors += 1
+						raise IOError(errno.EREMOTEIO, os.strerror(errno.EREMOTEIO))
+					bits += 9 * msg.len
+					if msg.flags & I2C_M_RD:
+						data = controller.transmit(msg.len)
+						memmove(msg.buf, str(data), msg.len)
+					else:
+						controller.receive(bytearray(string_at(msg.buf, msg.len)))
+			finally:
+				self.wait(bits)
+
+	def wait(self, bits):
+		duration = float(bits) / self.clock
+		self.busy_time += duration
+		if self.realtime:
+			time.sleep(duration)
+
+
+buses = {}
+
+# Drop-in replacement of i2c.I2CMaster that performs the transactions on a
+# simulated bus
+class SimulatedI2CMaster(object):
+	def __init__(self, n=i2c.default_bus, extra_open_flags=0):
+		if n not in buses:
+			raise OSError(errno.ENOENT, os.strerror(errno.ENOENT), "/dev/i2c-%i" % n)
+		self.bus = buses[n]
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+	def close(self):
+		self.bus = None
+
+	def transaction(self, *msgs):
+		msg_array = (i2c_msg*len(msgs))(*msgs)
+		self.bus.transfer(msg_array, len(msgs))
+		return [i2c.i2c_msg_to_bytearray(m) for m in msgs if (m.flags & I2C_M_RD)]
+
+	def perform(self, transaction):
+		self.bus.transfer(transaction.ioctl_arg.msgs, transaction.ioctl_arg.nmsgs)
+
+
+# create simulated buses with controllers at the given addresses
+# (dict: bus number -> list of addresses) and use them instead of the hardware
+def install(bus_addresses, clock=100000, error_rate=0.0, realtime=True,
+		register_writes=False):
+	for n, addresses in bus_addresses.items():
+		bus = SimulatedBus(clock, error_rate, realtime)
+		for address in addresses:
+			bus.add(SimulatedController(address, register_writes))
+		buses[n] = bus
+	i2c.use_master(SimulatedI2CMaster)
+	return buses
+
+# distribute a fleet of controllers over as many buses as required, returns
+# the dict expected by install()
+def fleet(controllers, per_bus=100, first_address=0x08):
+	bus_addresses = {}
+	for idx in range(controllers):
+		bus_addresses.setdefault(idx // per_bus, []).append(first_address + idx % per_bus)
+	return bus_addresses
@@ -0,0 +1,67 @@
+#!/usr/bin/python
+import time
+import threading
+
+# target rate of the frames written to the controllers (frames/s)
+FRAME_RATE = 30.0
+
+# Writes the state of the installation to the controllers at a fixed rate.
+# Changes only mark the state as dirty with request(); at the next tick the
+# flush function writes the latest state once, so all changes within one
+# frame period are combined into one write per changed controller and the
+# bus load is bounded by the frame rate, no matter how many changes arrive.
+# Ticks without changes are skipped. A frame can also be requested for a
+# later time with request_at(), e.g. to retry a failed write when the circuit
+# breaker of the controller lets the next write through.
+class RenderLoop(threading.Thread):
+	def __init__(self, flush, fps=FRAME_RATE):
+		super(RenderLoop, self).__init__()
+		self.daemon = True
+		self.flush = flush
+		self.period = 1.0 / fps
+		self.dirty = threading.Event()
+		self.stopped = threading.Event()
+		self.lock = threading.Lock()
+		# the time of the earliest frame requested for later, None if none
+		self.due = None
+		self.frames = 0
+
+	# mark the state as changed, it is written with the next frame
+	def request(self):
+		self.dirty.set()
+
+	# request a frame at the given time (at the first tick after it)
+	def request_at(self, when):
+		with self.lock:
+			if self.due is None or when < self.due:
+				self.due = when
+
+	# True if the frame requested for later is due, the request is consumed
+	def take_due(self, now):
+		with self.lock:
+			if self.due is None or now < self.due:
+				return False
+			self.due = None
+			return True
+
+	def run(self):
+		next_frame = time.time()
+		while not self.stopped.is_set():
+			self.dirty.wait(self.period)
+			now = time.time()
+			if now < next_frame:
+				self.stopped.wait(next_frame - now)
+				now = time.time()
+			if self.stopped.is_set():
+				break
+			if not self.take_due(now) and not self.dirty.is_set():
+				continue
+			self.dirty.clear()
+			self.flush()
+			self.frames += 1
+			# keep the frame rate, but don't catch up on frames that were missed
+			next_frame = max(next_frame + self.period, now)
+
+	def stop(self):
+		self.stopped.set()
+		self.dirty.set()
@@ -0,0 +1,162 @@
+#!/usr/bin/python
+import io
+import os
+import json
+import threading
+import collections
+
+LED_SET_FILE = 'led_set.json'
+# delay between a change and its write (seconds), the changes within the
+# delay are written at once
+STORE_DELAY = 0.5
+# entries of the journal after which it is compacted into the storage file
+JOURNAL_SIZE = 200
+
+
+# Stores the LED-Sets in the background. Changes only mark the LED-Sets as
+# changed with request(); the storage thread waits for the store delay, so
+# all changes within it (e.g. of a slider) are written once, and writes the
+# LED-Sets outside the request that changed them.
+# The storage file is written to a temporary file that replaces it, so a
+# crash leaves either the previous or the new file, never a truncated one.
+# With the journal, only the changed LED-Sets are appended to the journal
+# file (one JSON object per line: {"name": ..., "led_set": {...} or null if
+# removed}), and the journal is compacted into the storage file once it
+# holds journal_size entries. A journal left by a crash is replayed by load().
+#
+# snapshot(names, complete) is called by the storage thread and returns the
+# LED-Sets to store: the list of all LED-Sets if complete (None otherwise),
+# and a list of (name, LED-Set or None if removed) for the given names.
+class LedSetStore(threading.Thread):
+	def __init__(self, snapshot, path=LED_SET_FILE, delay=STORE_DELAY,
+			journal=False, journal_size=JOURNAL_SIZE):
+		super(LedSetStore, self).__init__()
+		self.daemon = True
+		self.snapshot = snapshot
+		self.path = path
+		self.journal_path = path + '.journal'
+		self.delay = delay
+		self.journal = journal
+		self.journal_size = journal_size
+		self.journal_entries = 0
+		self.lock = threading.Lock()
+		# the names of the LED-Sets changed since the last write
+		self.changed = set()
+		self.pending = False
+		self.dirty = threading.Event()
+		self.stopped = threading.Event()
+		self.writes = 0
+
+	# the stored LED-Sets, the journal is replayed onto the storage file
+	def load(self):
+		led_sets = collections.OrderedDict()
+		if os.path.exists(self.path):
+			with io.open(self.path, 'r', encoding='utf-8') as led_set_file:
+				try:
+					stored = json.loads(led_set_file.read() or '[]')
+				except ValueError as e:
+					print(e, "LED-Set storage file corrupted")
+					stored = []
+				if not isinstance(stored, list):
+					print("LED-Set storage file corrupted")
+					stored = []
+				for led_set in stored:
+					if isinstance(led_set, dict) and 'name' in led_set:
+						led_sets[led_set['name']] = led_set
+					else:
+						print("LED-Set storage file holds an invalid LED-Set, skipped")
+		self.journal_entries = 0
+		if os.path.exists(self.journal_path):
+			with io.open(self.journal_path, 'r', encoding='utf-8') as journal_file:
+				for line in journal_file:
+					try:
+						entry = json.loads(line)
+					except ValueError:
+						# the last entry may be incomplete after a crash
+						continue
+					self.journal_entries += 1
+					if not valid_entry(entry):
+						print("LED-Set journal holds an invalid entry, skipped")
+						continue
+					led_sets.pop(entry['name'], None)
+					if entry['led_set'] is not None:
+						led_sets[entry['name']] = entry['led_set']
+		return list(led_sets.values())
+
+	# mark LED-Sets as changed, they are written after the store delay
+	def request(self, *names):
+		with self.lock:
+			self.changed.update(names)
+			self.pending = True
+		self.dirty.set()
+
+	def run(self):
+		while not self.stopped.is_set():
+			self.dirty.wait()
+			self.stopped.wait(self.delay)
+			self.dirty.clear()
+			self.flush()
+
+	# write the changes requested since the last write
+	def flush(self):
+		with self.lock:
+			if not self.pending:
+				return
+			names, self.changed = self.changed, set()
+			self.pending = False
+		try:
+			if self.journal and self.journal_entries + len(names) <= self.journal_size:
+				self.append_journal(self.snapshot(names, False)[1])
+			else:
+				led_sets, entries = self.snapshot(names, True)
+				# the journal is consistent with the storage file until
+				# it is truncated, in case the write is interrupted
+				if self.journal_entries:
+					self.append_journal(entries)
+				self.write(led_sets)
+		except (IOError, OSError) as e:
+			print(e, "LED-Sets could not be stored")
+			self.request(*names)
+			return
+		self.writes += 1
+
+	# replace the storage file with the given LED-Sets and truncate the journal
+	def write(self, led_sets):
+		temp_path = self.path + '.tmp'
+		with io.open(temp_path, 'wb') as led_set_file:
+			led_set_file.write(encode(led_sets))
+			led_set_file.flush()
+			os.fsync(led_set_file.fileno())
+		os.rename(temp_path, self.path)
+		if self.journal_entries or os.path.exists(self.journal_path):
+			io.open(self.journal_path, 'wb').close()
+			self.journal_entries = 0
+
+	def append_journal(self, entries):
+		if not entries:
+			return
+		with io.open(self.journal_path, 'ab') as journal_file:
+			for name, led_set in entries:
+				journal_file.write(encode({'name': name, 'led_set': led_set}) + b'\n')
+			journal_file.flush()
+			os.fsync(journal_file.fileno())
+		self.journal_entries += len(entries)
+
+	# write the pending changes and stop the storage thread
+	def stop(self):
+		self.stopped.set()
+		self.dirty.set()
+
+
+# whether a journal entry names an LED-Set and holds it or None if removed
+def valid_entry(entry):
+	return (isinstance(entry, dict) and 'name' in entry and 'led_set' in entry
+			and (entry['led_set'] is None or isinstance(entry['led_set'], dict)))
+
+
+# the UTF-8 encoded JSON representation of a value
+def encode(value):
+	data = json.dumps(value, ensure_ascii=False)
+	if not isinstance(data, bytes):
+		data = data.encode('utf-8')
+	return data
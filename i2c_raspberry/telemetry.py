@@ -0,0 +1,23 @@
+#!/usr/bin/python
+import threading
+
+# seconds between two status reads of all controllers
+TELEMETRY_INTERVAL = 2.0
+
+# Requests a status read of all controllers at a low, fixed rate. The reads
+# are queued by the request function with a priority below the frames, so
+# they are interleaved with the frames on the bus.
+class TelemetryPoller(threading.Thread):
+	def __init__(self, request, interval=TELEMETRY_INTERVAL):
+		super(TelemetryPoller, self).__init__()
+		self.daemon = True
+		self.request = request
+		self.interval = interval
+		self.stopped = threading.Event()
+
+	def run(self):
+		while not self.stopped.wait(self.interval):
+			self.request()
+
+	def stop(self):
+		self.stopped.set()
@@ -26,6 +26,9 @@
  * rxbuffer at the offset defined by the previously set address.
  * !write operations will fail if the address is not set
  * 
+ * If TWI_REGISTER_PREFIX is defined, write operations (length > 2) carry
+ * the address in their first byte instead (register write mode).
+ * 
  * Following  read operations will be served from the txbuffer at the offset
  * defined by the previously set address.
  * !read operations will start from offset=0 if the address is not set
@@ -201,6 +204,17 @@ ISR (TWI_vect)
 			 * read/write address */
 			if (buffer_addr == 1)
 				write_destination = internal_buffer[0];
+#ifdef TWI_REGISTER_PREFIX
+			/* register write mode: the first byte is the destination address,
+			 * followed by the data and the length byte */
+			else if (buffer_addr > 2 &&
+							internal_buffer[0] + buffer_addr - 2 <= BUFFER_SIZE &&
+							buffer_addr == internal_buffer[buffer_addr-1]) {
+				write_destination = internal_buffer[0];
+				memcpy((void*)&rxbuffer[write_destination], (void*)&internal_buffer[1], buffer_addr-2);
+				sl_receive_cb(write_destination, buffer_addr-1);
+			}
+#endif
 			/* received a complete transmission. If a valid write address was
 			 * provided && the last data byte matches the number of received
 			 * bytes (very simple protection mechanism against faulty transmissions),
@@ -234,7 +248,7 @@ ISR (TWI_vect)
 			sl_transmit_cb(write_destination);
 		case TW_ST_DATA_ACK:	/* byte transmitted, received ACK */
 			/* transmit next byte from buffer */
-			TWDR = rxbuffer[write_destination++]; //todo: should be txbuffer
+			TWDR = txbuffer[write_destination++];
 			/* more data to for transmission available?
 			 * TWCR_NACK signals the end of transmission, next state is either
 			 * TW_ST_DATA_NACK or TW_ST_LAST_DATA depending on weather the Master
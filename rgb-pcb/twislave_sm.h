@@ -26,6 +26,9 @@
  * rxbuffer at the offset defined by the previously set address.
  * !write operations will fail if the address is not set
  * 
+ * If TWI_REGISTER_PREFIX is defined, write operations (length > 2) carry
+ * the address in their first byte instead (register write mode).
+ * 
  * Following  read operations will be served from the txbuffer at the offset
  * defined by the previously set address.
  * !read operations will start from offset=0 if the address is not set
@@ -59,6 +62,12 @@
 /* Size for transmit and receive buffers */
 #define BUFFER_SIZE 32
 
+/* Register write mode: if defined, the first byte of a write transmission
+ * with more than 2 bytes is the destination address in the rxbuffer, so that
+ * a write doesn't need a separate 1 byte address transmission.
+ * The host has to send register writes as well (register_writes=True) */
+/* #define TWI_REGISTER_PREFIX */
+
 /*
  * Global variables
  */
@@ -0,0 +1,130 @@
+#!/usr/bin/python
+import json
+
+import gevent
+from gevent.queue import Queue, Empty
+
+from i2c_raspberry import HttpError
+
+# interval at which the changes of the installation are pushed (seconds)
+PUSH_INTERVAL = 0.1
+# messages queued for a client, a client that falls further behind is sent a
+# resync message instead of the changes
+CLIENT_BACKLOG = 32
+
+
+''' pushes the changes of the installation to the connected clients of the
+live channel: every PUSH_INTERVAL the changes since the last push are read
+from the change log of the coordinator once, serialized once, and queued
+for all clients '''
+class LiveHub(object):
+	def __init__(self, coordinator, interval=PUSH_INTERVAL, backlog=CLIENT_BACKLOG):
+		self.coordinator = coordinator
+		self.interval = interval
+		self.backlog = backlog
+		self.clients = set()
+		self.version = coordinator.version
+		self.greenlet = None
+
+	''' the queue of the messages for a new client, starting with the
+	current version '''
+	def subscribe(self):
+		if self.greenlet is None:
+			self.greenlet = gevent.spawn(self.run)
+		queue = Queue(self.backlog)
+		queue.put(encode({'version': self.version}))
+		self.clients.add(queue)
+		return queue
+
+	def unsubscribe(self, queue):
+		self.clients.discard(queue)
+
+	def run(self):
+		while True:
+			gevent.sleep(self.interval)
+			if not self.clients:
+				self.version = self.coordinator.version
+				continue
+			if self.coordinator.version == self.version:
+				continue
+			changes = self.coordinator.get_changes(self.version)
+			self.version = changes['version']
+			self.publish(encode(changes))
+
+	def publish(self, message):
+		for queue in list(self.clients):
+			if queue.full():
+				# the client has to fetch the complete state
+				while not queue.empty():
+					queue.get_nowait()
+				queue.put_nowait(encode({'version': self.version, 'resync': True}))
+			else:
+				queue.put_nowait(message)
+
+
+''' applies a message of a client, returns the error message or None:
+[addr, channel, r, g, b] sets the color of a LED, [name, r, g, b] the color
+of all LEDs of a LED-Set, and {"changes": [...]} is a batch of changes.
+A binary message is a frame of controller registers (see
+RgbCoordinator.ingest_frame) '''
+def apply_message(coordinator, message):
+	try:
+		if isinstance(message, bytearray):
+			coordinator.ingest_frame(message)
+			return None
+		update = json.loads(message)
+		if isinstance(update, dict):
+			coordinator.apply_changes(update)
+		elif isinstance(update, list) and len(update) == 5:
+			coordinator.set_led_rgb(*update)
+		elif isinstance(update, list) and len(update) == 4:
+			coordinator.set_led_set_rgb(*update)
+		else:
+			raise HttpError('unknown message', 400)
+	except HttpError as e:
+		return encode({'error': str(e), 'code': e.error_code})
+	except (ValueError, TypeError) as e:
+		return encode({'error': str(e), 'code': 400})
+	return None
+
+''' forward the pushed messages to a client until it disconnects '''
+def push_messages(hub, queue, send):
+	try:
+		while True:
+			send(queue.get())
+	finally:
+		hub.unsubscribe(queue)
+
+''' serve a client of the live channel on a WebSocket: the updates of the
+client are applied as they arrive, the changes are pushed by the hub '''
+def serve_websocket(hub, websocket):
+	queue = hub.subscribe()
+	pusher = gevent.spawn(push_messages, hub, queue, websocket.send)
+	try:
+		while True:
+			message = websocket.receive()
+			if message is None:
+				break
+			error = apply_message(hub.coordinator, message)
+			if error is not None:
+				websocket.send(error)
+	finally:
+		pusher.kill()
+		hub.unsubscribe(queue)
+
+''' the pushed messages as server-sent events, for clients without
+WebSocket, which send their updates through the REST API '''
+def event_stream(hub):
+	queue = hub.subscribe()
+	try:
+		while True:
+			try:
+				yield 'data: %s\n\n' % queue.get(timeout=15)
+			except Empty:
+				# keep the connection open
+				yield ': keep-alive\n\n'
+	finally:
+		hub.unsubscribe(queue)
+
+def encode(message):
+	return json.dumps(message, separators=(',', ':'))
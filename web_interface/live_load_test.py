@@ -0,0 +1,120 @@
+#!/usr/bin/python
+import sys
+import time
+import json
+import httplib
+
+import gevent
+from gevent.pywsgi import WSGIServer
+
+try:
+	import websocket
+except ImportError:
+	websocket = None
+
+from web_interface import app, views
+from web_interface.views import WebSocketHandler
+from i2c_raspberry import RgbCoordinator, i2c_sim
+
+''' load test of the live channel: clients stream color updates to the
+coordinator (simulated controllers) and receive the pushed changes of all
+clients, compared with the same updates sent as PATCH requests.
+Requires gevent-websocket and websocket-client.
+Run it as a module from the root of the repository:
+usage: python -m web_interface.live_load_test [clients] [updates per client]
+	[updates/s per client] '''
+
+PORT = 5001
+
+def percentile(values, fraction):
+	if not values:
+		return 0.0
+	values = sorted(values)
+	return values[min(int(len(values) * fraction), len(values) - 1)]
+
+''' the LED of a client, every client changes a LED of its own '''
+def client_led(coordinator, idx):
+	controllers = sorted(coordinator.controllers.keys())
+	controller = coordinator.controllers[controllers[idx % len(controllers)]]
+	return controller.addr, (idx // len(controllers)) % controller.led_cnt
+
+''' streams updates color updates on the live channel and measures the time
+until the update is pushed back '''
+def live_client(coordinator, idx, updates, rate, stats):
+	addr, channel = client_led(coordinator, idx)
+	socket = websocket.create_connection('ws://127.0.0.1:%d/live' % PORT)
+	sent = {}
+	def receive():
+		while True:
+			data = socket.recv()
+			stats['pushes'] += 1
+			stats['push_bytes'] += len(data)
+			message = json.loads(data)
+			for led in message.get('led', []):
+				if (led['controller'], led['channel']) == (addr, channel):
+					value = led['color']['b']
+					if value in sent:
+						stats['latency'].append(time.time() - sent.pop(value))
+	receiver = gevent.spawn(receive)
+	for update in range(updates):
+		value = update % 256
+		message = json.dumps([addr, channel, 0, 0, value])
+		sent[value] = time.time()
+		socket.send(message)
+		stats['bytes'] += len(message)
+		gevent.sleep(1.0 / rate)
+	gevent.sleep(0.5)
+	receiver.kill()
+	socket.close()
+
+''' sends the same updates as PATCH requests '''
+def http_client(coordinator, idx, updates, rate, stats):
+	addr, channel = client_led(coordinator, idx)
+	for update in range(updates):
+		body = json.dumps({'leds': [{'channel': channel, 'color': {'b': update % 256}}]})
+		start = time.time()
+		connection = httplib.HTTPConnection('127.0.0.1', PORT)
+		connection.request('PATCH', '/controller/%d' % addr, body,
+				{'Content-Type': 'application/json'})
+		response = connection.getresponse()
+		data = response.read()
+		connection.close()
+		stats['latency'].append(time.time() - start)
+		# request line, headers and body in both directions
+		stats['bytes'] += (len(body) + len(data) + 150 +
+				sum(len(k) + len(v) + 4 for k, v in response.getheaders()))
+		gevent.sleep(1.0 / rate)
+
+def run_clients(name, client, coordinator, clients, updates, rate):
+	stats = {'latency': [], 'bytes': 0, 'pushes': 0, 'push_bytes': 0}
+	start = time.time()
+	gevent.joinall([gevent.spawn(client, coordinator, idx, updates, rate, stats)
+			for idx in range(clients)])
+	duration = time.time() - start
+	total = clients * updates
+	print("%-5s %d clients: %6.0f updates/s, %5.1f bytes/update, latency %5.1f ms "
+			"(95%%: %5.1f ms)" % (name, clients, total / duration,
+			float(stats['bytes']) / total,
+			sum(stats['latency']) * 1000.0 / max(len(stats['latency']), 1),
+			percentile(stats['latency'], 0.95) * 1000.0))
+	if stats['pushes']:
+		print("      %d pushes, %.0f bytes/push" % (stats['pushes'],
+				float(stats['push_bytes']) / stats['pushes']))
+
+if __name__ == "__main__":
+	if websocket is None or WebSocketHandler is None:
+		print("the load test requires gevent-websocket and websocket-client")
+		sys.exit(1)
+	clients = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+	updates = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+	rate = float(sys.argv[3]) if len(sys.argv) > 3 else 20.0
+	buses = i2c_sim.install(i2c_sim.fleet(max(clients // 4, 1)))
+	coordinator = RgbCoordinator(sorted(buses.keys()))
+	coordinator.scan_i2c_bus()
+	views.coordinator = coordinator
+	server = WSGIServer(('127.0.0.1', PORT), app, handler_class=WebSocketHandler, log=None)
+	server.start()
+	run_clients('live', live_client, coordinator, clients, updates, rate)
+	run_clients('http', http_client, coordinator, clients, updates, rate)
+	server.stop()
+	coordinator.stop()
@@ -445,6 +445,15 @@ $(document).on('pagebeforeshow', '#control_led_set', function(event) {
 					showButtons: false,
 					showInput: true,
 					preferredFormat: "rgb",
+					// stream the color while the picker is moved
+					move: function(color) {
+						if ($('#control_led_set').data('live-mode') && liveChannelOpen()) {
+							var led_set = $('#control_led_set').data('led-set');
+							var led_id = $(this).parent().data('id');
+							sendLedColor(led_set,
+								$('#control_led_set').data('unify-mode') ? null : led_id, color);
+						}
+					},
 					hide: function(color) {
 						$(this).css('background-color', color.toRgbString());
 						var led_set = $('#control_led_set').data('led-set');
@@ -459,7 +468,17 @@ $(document).on('pagebeforeshow', '#control_led_set', function(event) {
 							}
 						}
 						if ($('#control_led_set').data('live-mode')) {
-							putLedSet(led_set);
+							if (liveChannelOpen()) {
+								sendLedColor(led_set,
+									$('#control_led_set').data('unify-mode') ? null : led_id, color);
+							} else if ($('#control_led_set').data('unify-mode')) {
+								patchLedSet(led_set, { color: color.toRgb() });
+							} else {
+								patchLedSet(led_set, { leds: [ {
+									controller: led_set.leds[led_id].controller,
+									channel: led_set.leds[led_id].channel,
+									color: color.toRgb() } ] });
+							}
 						}
 					}
 				} );
@@ -514,51 +533,16 @@ $(document).on('slidestop', '#led_set_unify_mode', function(event, ui) {
 });
 
 
-$(function() {
-		var timer = null;
-		var interval = 100;
-		var ticker = 0;
-
-	function tick() {
-		ticker += 0.025;
-		callback();
-		start();        // restart the timer
-	};
- 
- function start() {
-		timer = setTimeout(tick, interval);
-		$('#control_led_set').find('#led_set_unify_mode').val('on').slider('refresh');
-		$('#control_led_set').find('#led_set_live_mode').val('on').slider('refresh');
-		$('#control_led_set').data('unify-mode', true);
-		$('#control_led_set').data('live-mode', true);
-		
-	};
-
-	function stop() {
-		clearTimeout(timer);
-		tick = 0;
-	};
-	
-	function callback() {
-		var led_set = $('#control_led_set').data('led-set');
-		// color string for this LED
-		var rgb_color = tinycolor(led_set.leds[0].color);
-		var new_color = rgb_color.toRgb();
-		new_color.r = Math.round((Math.sin(ticker)+1) * 128);
-		new_color.g = Math.round((Math.sin(ticker+1.8)+1) * 128);
-		new_color.b = Math.round((Math.sin(ticker+2.5)+1) * 128);
-		
-		// trigger the color change event for one of the LEDs
-		$('#led0_color')
-			.css('background-color', new_color)
-			.spectrum("set", new_color);
-		$('#led0_color').spectrum('set', new_color);
-		$('#led0_color').trigger('click');
-	};
-	
-	$(document).on('click', '#led_set_animate', start);
-	$(document).on('click', '#led_set_animate_stop', stop);
+// start/stop an effect on the LED-Set, the colors are computed by the
+// coordinator, so the animation doesn't need a request per frame
+$(document).on('click', '#led_set_animate', function(event) {
+	var led_set = $('#control_led_set').data('led-set');
+	var effect = { effect: $('#led_set_effect').val() };
+	putEffect(led_set, effect);
+});
 
+$(document).on('click', '#led_set_animate_stop', function(event) {
+	deleteEffect($('#control_led_set').data('led-set'));
 });
 
 
@@ -567,7 +551,7 @@ $(document).on('slidestop', '#led_set_status', function(event, ui) {
 	var led_set = $('#control_led_set').data('led-set');
 	led_set.status = $(this).val();
 	if ($('#control_led_set').data('live-mode')) {
-		putLedSet(led_set);
+		patchLedSet(led_set, { status: led_set.status });
 	}
 });
 
@@ -575,9 +559,11 @@ $(document).on('slidestop', '#led_set_status', function(event, ui) {
 // (triggered if the "LED-Set Name" textbox was selected and looses focus
 $(document).on('change', '#led_set_name', function(event) {
 	var led_set = $('#control_led_set').data('led-set');
-	led_set.name = $(this).val();
+	var name = $(this).val();
 	if ($('#control_led_set').data('live-mode')) {
-		putLedSet(led_set);
+		patchLedSet(led_set, { name: name });
+	} else {
+		led_set.name = name;
 	}
 });
 
@@ -597,7 +583,14 @@ $(document).on('slidestop', '#control_led_set [name*="slider"]', function(event,
 		}
 	}
 	if ($('#control_led_set').data('live-mode')) {
-		putLedSet(led_set);
+		if ($('#control_led_set').data('unify-mode')) {
+			patchLedSet(led_set, { current_limit: new_limit });
+		} else {
+			patchLedSet(led_set, { leds: [ {
+				controller: led_set.leds[id].controller,
+				channel: led_set.leds[id].channel,
+				current_limit: new_limit } ] });
+		}
 	}
 	
 });
@@ -756,6 +749,70 @@ function addLedSetsToStatusList(data) {
 }
 
 
+/* ---------------------------------------------------------------------
+ * ########################### Live channel ############################
+ * ---------------------------------------------------------------------*/
+// persistent connection to the coordinator: in live mode the colors are
+// streamed as compact messages, and the changes of all clients are pushed
+// back. Without WebSocket the live mode sends PATCH requests.
+var liveSocket = null;
+
+function openLiveChannel() {
+	if (!window.WebSocket) {
+		return;
+	}
+	liveSocket = new WebSocket('ws://' + location.host + '/live');
+	liveSocket.onmessage = function(event) {
+		handleLiveMessage(JSON.parse(event.data));
+	};
+	liveSocket.onclose = function() {
+		liveSocket = null;
+		setTimeout(openLiveChannel, 5000);
+	};
+}
+$(openLiveChannel);
+
+function liveChannelOpen() {
+	return liveSocket !== null && liveSocket.readyState === WebSocket.OPEN;
+}
+
+// send the color of a LED of the set, or of all its LEDs if led_id is null:
+// [controller, channel, r, g, b] or [led set name, r, g, b]
+function sendLedColor(led_set, led_id, color) {
+	var rgb = color.toRgb();
+	if (led_id === null) {
+		liveSocket.send(JSON.stringify([led_set.name, rgb.r, rgb.g, rgb.b]));
+	} else {
+		var led = led_set.leds[led_id];
+		liveSocket.send(JSON.stringify([led.controller, led.channel, rgb.r, rgb.g, rgb.b]));
+	}
+}
+
+// show the pushed colors of the LEDs of the controlled LED-Set
+function handleLiveMessage(message) {
+	if (message.error) {
+		console.log('live update failed: ' + message.error);
+		return;
+	}
+	var led_set = $('#control_led_set').data('led-set');
+	if (!led_set || !message.led) {
+		return;
+	}
+	for (var i = 0; i < message.led.length; i++) {
+		var changed = message.led[i];
+		for (var j = 0; j < led_set.leds.length; j++) {
+			if (led_set.leds[j].controller === changed.controller &&
+					led_set.leds[j].channel === changed.channel) {
+				led_set.leds[j].color = changed.color;
+				$('#led'+j+'_color').css('background-color',
+						tinycolor(changed.color).toRgbString());
+			}
+		}
+	}
+}
+
+
+
 /* ---------------------------------------------------------------------
  * ####################### RESTApi interaction #########################
  * ---------------------------------------------------------------------*/
@@ -834,6 +891,22 @@ function putLedSet(ledSetJson) {
 	});
 }
 
+// send only the changed fields of the LED-Set (live mode), the response
+// contains the changed fields, the name and the (new) URI of the set
+function patchLedSet(ledSetJson, changes) {
+	$.ajax( {
+		type: "PATCH",
+		url: ledSetJson.uri,
+		data: JSON.stringify(changes),
+		contentType: "application/json",
+		success: function(data, xml_request, options) {
+			ledSetJson.name = data.name;
+			ledSetJson.uri = data.uri;
+			console.log('LED-Set patched');
+		}
+	});
+}
+
 function deleteLedSet(ledSetJson) {
 	$.ajax( {
 		type: "DELETE",
@@ -844,3 +917,26 @@ function deleteLedSet(ledSetJson) {
 		}
 	});
 }
+
+function putEffect(ledSetJson, effectJson) {
+	$.ajax( {
+		type: "PUT",
+		url: ledSetJson.uri + '/effect',
+		data: JSON.stringify(effectJson),
+		contentType: "application/json",
+		success: function(data, xml_request, options) {
+			console.log('Effect started');
+		}
+	});
+}
+
+function deleteEffect(ledSetJson) {
+	$.ajax( {
+		type: "DELETE",
+		url: ledSetJson.uri + '/effect',
+		data: null,
+		success: function(data, xml_request, options) {
+			console.log('Effect stopped');
+		}
+	});
+}
@@ -76,6 +76,52 @@ test("Controller attributes can be modified", function() {
 	});
 });
 
+/* controllers from the third bus on have addresses above 256 */
+test("Controller attributes on further buses can be modified", function() {
+	var controllers = $.grep(this.controller_list.controller, function(controller) {
+		return controller.addr > 256;
+	});
+	if (controllers.length == 0) {
+		ok(true, "No controller on a third bus available");
+	}
+	$.each(controllers, function(index, controller) {
+		var mod_controller = jQuery.extend({}, controller);
+		mod_controller.name = 'bus test ' + controller.addr;
+		api_test(controller.uri, 'PUT', mod_controller, false, function(json, jqXHR) {
+			ok(jqXHR.status == 200, "Controller " + controller.addr + " modified");
+			ok(json.name === mod_controller.name, "Controller name changed");
+		});
+	});
+});
+
+test("Single controller attributes can be patched", function() {
+	var controller = this.controller_list.controller[0];
+	var new_brightness = (controller.brightness + 1) % 256;
+	api_test(controller.uri, 'PATCH', {brightness: new_brightness}, false, function(json, jqXHR) {
+		ok( jqXHR.status == 200, "Controller patched");
+		ok( json.brightness === new_brightness, "Controller brightness changed");
+		ok( json.name === undefined && json.leds === undefined, "Only changed fields returned");
+	});
+	api_test(controller.uri, 'PATCH', {leds: [ {channel: 0, color: {r: 10}} ]}, false, function(json, jqXHR) {
+		ok( json.leds.length === 1, "Only the changed LED returned");
+		ok( json.leds[0].color.r === 10, "LED color changed");
+	});
+});
+
+test("Trying to patch the address of a controller (should not be possible)", function() {
+	var controller = this.controller_list.controller[0];
+	api_test(controller.uri, 'PATCH', {addr: controller.addr + 1}, false, function(json, jqXHR) {
+		ok(jqXHR.status == 409, "Address change not possible");
+	});
+});
+
+test("Trying to patch a name that is not a string (should not be possible)", function() {
+	var controller = this.controller_list.controller[0];
+	api_test(controller.uri, 'PATCH', {name: {a: 1}}, false, function(json, jqXHR) {
+		ok(jqXHR.status == 409, "Name has to be a string");
+	});
+});
+
 test("Trying to change address of controller (should not be possible)", function() {
 	var new_addr = this.controller_list.controller[0].addr + 1;
 	var mod_controller = jQuery.extend({}, this.controller_list.controller[0]);
@@ -315,3 +361,384 @@ test("Remove a LED from an existing LED-Set", function() {
 		ok( jqXHR.status === 204, "Delete LED-Set");
 	});
 });
+
+test("Unchanged LED-Set listing is not sent again", function() {
+	var me = this;
+	var etag = null;
+	api_test(this.led_set_url, 'GET', null, false, function(json, jqXHR) {
+		etag = jqXHR.getResponseHeader('ETag');
+		ok( etag, "Listing has an ETag");
+	});
+	$.ajax( {url: this.led_set_url, type: 'GET', async: false,
+			headers: {'If-None-Match': etag} })
+		.always( function (data, textStatus, jqXHR) {
+			ok( jqXHR.status == 304, "Listing not modified");
+		});
+	var new_set = this.led_set;
+	new_set.name = 'changes the listing';
+	new_set.leds[0] = this.controller_list.controller[0].leds[0];
+	api_test(this.led_set_url , 'POST', new_set, false, function(json, jqXHR) {
+		ok( jqXHR.status == 200, "Add LED-Set");
+		me.led_set = json;
+	});
+	$.ajax( {url: this.led_set_url, type: 'GET', async: false, dataType: 'json',
+			headers: {'If-None-Match': etag} })
+		.always( function (data, textStatus, jqXHR) {
+			ok( jqXHR.status == 200, "Changed listing sent");
+			ok( jqXHR.getResponseHeader('ETag') != etag, "ETag of the listing changed");
+		});
+	api_test(me.led_set.uri, 'DELETE', null, false, function(json, jqXHR) {
+		ok( jqXHR.status === 204, "Delete LED-Set");
+	});
+});
+
+test("Patch a LED-Set", function() {
+	var me = this;
+	var new_set = this.led_set;
+	new_set.name = 'about to be patched';
+	new_set.leds[0] = this.controller_list.controller[0].leds[0];
+	new_set.leds[1] = this.controller_list.controller[0].leds[1];
+	api_test(this.led_set_url , 'POST', new_set, false, function(json, jqXHR) {
+		ok( jqXHR.status == 200, "Add LED-Set");
+		me.led_set = json;
+	});
+	api_test(me.led_set.uri, 'PATCH', {status: 'on', color: {b: 20}}, false, function(json, jqXHR) {
+		ok( json.status === 'on', "Set status patched");
+		ok( json.leds.length === 2 && json.leds[1].color.b === 20, "Color of all LEDs patched");
+	});
+	var led = me.led_set.leds[1];
+	api_test(me.led_set.uri, 'PATCH', {leds: [ {controller: led.controller,
+			channel: led.channel, current_limit: 120} ]}, false, function(json, jqXHR) {
+		ok( json.leds.length === 1, "Only the changed LED returned");
+		ok( json.leds[0].current_limit === 120, "Current limit of the LED patched");
+	});
+	api_test(me.led_set.uri, 'PATCH', {name: 'patched'}, false, function(json, jqXHR) {
+		ok( json.name === 'patched', "Set name patched");
+		me.led_set = json;
+	});
+	// remove the set again
+	api_test(me.led_set.uri, 'DELETE', null, false, function(json, jqXHR) {
+		ok( jqXHR.status === 204, "Delete LED-Set");
+	});
+});
+
+test("Try to patch a LED that is not part of the LED-Set", function() {
+	var me = this;
+	var new_set = this.led_set;
+	new_set.name = 'patch foreign led';
+	new_set.leds[0] = this.controller_list.controller[0].leds[0];
+	api_test(this.led_set_url , 'POST', new_set, false, function(json, jqXHR) {
+		ok( jqXHR.status == 200, "Add LED-Set");
+		me.led_set = json;
+	});
+	var led = this.controller_list.controller[0].leds[1];
+	api_test(me.led_set.uri, 'PATCH', {leds: [ {controller: led.controller,
+			channel: led.channel, color: {r: 1}} ]}, false, function(json, jqXHR) {
+		ok( jqXHR.status == 409, "LED not part of the set");
+	});
+	api_test(me.led_set.uri, 'DELETE', null, false, function(json, jqXHR) {
+		ok( jqXHR.status === 204, "Delete LED-Set");
+	});
+});
+
+/* ---------------------------------------------------------------------
+ * ################### Effect API test module ##########################
+ * -------------------------------------------------------------------*/
+module("Effect API", {
+	setup: function() {
+		var me = this;
+		this.controller_url = "http://"+ location.host + "/controller";
+		this.led_set_url = "http://"+ location.host + "/led_set";
+		this.effects_url = "http://"+ location.host + "/effects";
+		api_test(this.controller_url, 'GET', null, false, function(json, jqXHR) {
+			ok( jqXHR.status == 200, "Connected to Controller API");
+			me.controller_list = json;
+		});
+		var new_set = {
+			name: 'animated',
+			status: 'on',
+			leds: [ this.controller_list.controller[0].leds[0] ]
+		};
+		api_test(this.led_set_url, 'POST', new_set, false, function(json, jqXHR) {
+			ok( jqXHR.status == 200, "Add LED-Set");
+			me.led_set = json;
+		});
+	},
+	teardown: function() {
+		api_test(this.led_set.uri, 'DELETE', null, false, function(json, jqXHR) {
+			ok( jqXHR.status === 204, "Delete LED-Set");
+		});
+	}
+});
+
+test("List the available effects", function() {
+	api_test(this.effects_url, 'GET', null, false, function(json, jqXHR) {
+		ok( jqXHR.status == 200, "Connected to Effect API");
+		ok( json.effects.length > 0, "Effects available");
+		ok( json.effects[0].effect && json.effects[0].params, "Effect has name and parameters");
+	});
+});
+
+test("Start, modify and stop an effect", function() {
+	var effect_uri = this.led_set.uri + '/effect';
+	api_test(effect_uri, 'PUT', {effect: 'breathe'}, false, function(json, jqXHR) {
+		ok( jqXHR.status == 200, "Effect started");
+		ok( json.effect === 'breathe', "Effect is correct");
+		ok( json.params.speed > 0, "Default parameters set");
+	});
+	api_test(effect_uri, 'PUT', {effect: 'breathe', params: {speed: 1}}, false, function(json, jqXHR) {
+		ok( json.params.speed === 1, "Effect parameter modified");
+	});
+	api_test(this.led_set.uri, 'GET', null, false, function(json, jqXHR) {
+		ok( json.effect.effect === 'breathe', "LED-Set contains the effect");
+	});
+	api_test(effect_uri, 'DELETE', null, false, function(json, jqXHR) {
+		ok( jqXHR.status === 204, "Effect stopped");
+	});
+	api_test(effect_uri, 'GET', null, false, function(json, jqXHR) {
+		ok( json.effect === null, "No effect running");
+	});
+});
+
+test("Try to start an unknown effect", function() {
+	api_test(this.led_set.uri + '/effect', 'PUT', {effect: 'not_existing'}, false, function(json, jqXHR) {
+		ok( jqXHR.status == 409, "Unknown effect not started");
+	});
+});
+
+test("Try to start an effect with invalid parameters", function() {
+	api_test(this.led_set.uri + '/effect', 'PUT', {effect: 'chase', params: {speed: 'fast'}}, false, function(json, jqXHR) {
+		ok( jqXHR.status == 409, "Effect with invalid parameters not started");
+	});
+});
+
+test("Try to start an effect on a non-existing LED-Set", function() {
+	api_test(this.led_set_url + '/not_existing/effect', 'PUT', {effect: 'sine'}, false, function(json, jqXHR) {
+		ok( jqXHR.status == 404, "LED-Set does not exist");
+	});
+});
+
+/* ---------------------------------------------------------------------
+ * ################### Batch API test module ###########################
+ * -------------------------------------------------------------------*/
+module("Batch API", {
+	setup: function() {
+		var me = this;
+		this.controller_url = "http://"+ location.host + "/controller";
+		this.led_set_url = "http://"+ location.host + "/led_set";
+		this.batch_url = "http://"+ location.host + "/batch";
+		api_test(this.controller_url, 'GET', null, false, function(json, jqXHR) {
+			ok( jqXHR.status == 200, "Connected to Controller API");
+			me.controller_list = json;
+		});
+	}
+});
+
+test("Apply changes of a controller and a LED-Set at once", function() {
+	var controller = jQuery.extend({}, this.controller_list.controller[0]);
+	var new_name = 'batch name test';
+	controller.name = new_name;
+	var new_set = {
+		name: 'batch',
+		status: 'on',
+		leds: [ controller.leds[0] ]
+	};
+	var changes = [
+		{method: 'PUT', controller: controller.addr, data: controller},
+		{method: 'POST', led_set: null, data: new_set}
+	];
+	api_test(this.batch_url, 'POST', {changes: changes}, false, function(json, jqXHR) {
+		ok( jqXHR.status == 200, "Changes applied");
+		ok( json.results.length === 2, "Result for every change");
+		ok( json.results[0].name === new_name, "Controller name changed");
+		ok( json.results[1].name === new_set.name, "LED-Set added");
+	});
+	api_test(this.led_set_url + '/batch', 'DELETE', null, false, function(json, jqXHR) {
+		ok( jqXHR.status === 204, "Delete LED-Set");
+	});
+});
+
+test("A failing change discards the complete batch", function() {
+	var controller = this.controller_list.controller[0];
+	var new_set = {
+		name: 'not applied',
+		status: 'on',
+		leds: [ controller.leds[0] ]
+	};
+	var changes = [
+		{method: 'POST', led_set: null, data: new_set},
+		{method: 'DELETE', led_set: 'not_existing'}
+	];
+	api_test(this.batch_url, 'POST', {changes: changes}, false, function(json, jqXHR) {
+		ok( jqXHR.status == 404, "Batch failed");
+	});
+	api_test(this.led_set_url + '/not applied', 'GET', null, false, function(json, jqXHR) {
+		ok( jqXHR.status == 404, "LED-Set of the failed batch not added");
+	});
+});
+
+test("Try to apply an incomplete batch", function() {
+	api_test(this.batch_url, 'POST', {changes: [ {led_set: 'batch'} ]}, false, function(json, jqXHR) {
+		ok( jqXHR.status == 409, "Incomplete change");
+	});
+});
+
+test("Try to apply a batch with invalid controller or LED-Set ids", function() {
+	var controller = this.controller_list.controller[0];
+	var invalid = [
+		{method: 'PATCH', controller: 'x', data: {brightness: 1}},
+		{method: 'PATCH', led_set: ['x'], data: {status: 'on'}},
+		{method: 'DELETE', led_set: {name: 'x'}}
+	];
+	$.each(invalid, function(index, change) {
+		var changes = [ {method: 'PATCH', controller: controller.addr, data: {name: 'not applied'}}, change ];
+		api_test(this.batch_url, 'POST', {changes: changes}, false, function(json, jqXHR) {
+			ok( jqXHR.status == 409, "Invalid id rejected");
+		});
+	}.bind(this));
+	api_test(controller.uri, 'GET', null, false, function(json, jqXHR) {
+		ok( json.name === controller.name, "Controller of the rejected batches unchanged");
+	});
+});
+
+/* ---------------------------------------------------------------------
+ * ################### Change API test module ##########################
+ * -------------------------------------------------------------------*/
+module("Change API", {
+	setup: function() {
+		var me = this;
+		this.controller_url = "http://"+ location.host + "/controller";
+		this.changes_url = "http://"+ location.host + "/changes";
+		api_test(this.controller_url, 'GET', null, false, function(json, jqXHR) {
+			ok( jqXHR.status == 200, "Connected to Controller API");
+			me.controller_list = json;
+		});
+		api_test(this.changes_url + '?since=0', 'GET', null, false, function(json, jqXHR) {
+			ok( jqXHR.status == 200, "Connected to Change API");
+			me.version = json.version;
+		});
+	}
+});
+
+test("Unknown versions require a resync", function() {
+	api_test(this.changes_url + '?since=0', 'GET', null, false, function(json, jqXHR) {
+		ok( json.resync === true, "Complete state has to be fetched");
+	});
+});
+
+test("Changes since a version contain the changed resources only", function() {
+	var me = this;
+	var controller = this.controller_list.controller[0];
+	api_test(controller.uri, 'PATCH', {brightness: controller.brightness}, false, function(json, jqXHR) {
+		ok( jqXHR.status == 200, "Controller patched");
+	});
+	api_test(this.changes_url + '?since=' + this.version, 'GET', null, false, function(json, jqXHR) {
+		ok( json.resync === false, "Changes known");
+		ok( json.version > me.version, "Version changed");
+		ok( json.controller.length >= 1, "Changed controller returned");
+		ok( json.controller[0].addr === controller.addr, "Correct controller returned");
+		me.version = json.version;
+	});
+	api_test(this.changes_url + '?since=' + me.version, 'GET', null, false, function(json, jqXHR) {
+		ok( json.led_set.length === 0 && json.removed_led_set.length === 0, "No changed LED-Sets");
+	});
+});
+
+/* ---------------------------------------------------------------------
+ * ################### Frame API test module ###########################
+ * -------------------------------------------------------------------*/
+
+/* the records of a binary frame, every record is the addr of a controller
+ * (2 bytes) and its registers 0-21 */
+function frame_records(records) {
+	var frame = new Uint8Array(records.length * 24);
+	for (var i = 0; i < records.length; i++) {
+		frame[i * 24] = records[i].addr >> 8;
+		frame[i * 24 + 1] = records[i].addr & 0xff;
+		frame.set(records[i].registers, i * 24 + 2);
+	}
+	return frame;
+}
+
+/* post a binary frame */
+function frame_test(url, frame, callback) {
+	$.ajax( {
+			url: url,
+			type: 'POST',
+			contentType: 'application/octet-stream',
+			data: frame.buffer,
+			processData: false,
+			async: false,
+		})
+		.always( function (data, textStatus, jqXHR) {
+			callback(jqXHR.status !== undefined ? jqXHR : data);
+		});
+}
+
+module("Frame API", {
+	setup: function() {
+		var me = this;
+		this.controller_url = "http://"+ location.host + "/controller";
+		this.frame_url = "http://"+ location.host + "/frame";
+		api_test(this.controller_url, 'GET', null, false, function(json, jqXHR) {
+			ok( jqXHR.status == 200, "Connected to Controller API");
+			me.controller = json.controller[0];
+		});
+	},
+	teardown: function() {
+		var controller = this.controller;
+		api_test(controller.uri, 'PATCH', {brightness: controller.brightness, leds: controller.leds}, false, function(json, jqXHR) {
+			ok( jqXHR.status == 200, "Controller restored");
+		});
+	}
+});
+
+test("Apply the registers of a controller", function() {
+	var controller = this.controller;
+	var registers = [];
+	for (var i = 0; i < 16; i++) {
+		registers.push(i * 16);
+	}
+	// current limits, current limit update, brightness
+	registers.push(100, 100, 100, 100, 0, 200);
+	frame_test(this.frame_url, frame_records([ {addr: controller.addr, registers: registers} ]), function(jqXHR) {
+		ok( jqXHR.status == 204, "Frame applied");
+	});
+	api_test(controller.uri, 'GET', null, false, function(json, jqXHR) {
+		ok( json.brightness === 200, "Brightness applied");
+		ok( json.leds[1].color.r === 64 && json.leds[1].color.b === 112, "Colors applied");
+	});
+});
+
+test("Try to apply a frame with an incomplete record", function() {
+	// the addr and 3 registers only
+	var frame = new Uint8Array([this.controller.addr >> 8, this.controller.addr & 0xff, 0, 0, 0]);
+	frame_test(this.frame_url, frame, function(jqXHR) {
+		ok( jqXHR.status == 409, "Incomplete record rejected");
+	});
+});
+
+test("Try to apply the registers of a non-existing controller", function() {
+	var registers = [];
+	for (var i = 0; i < 22; i++) {
+		registers.push(0);
+	}
+	frame_test(this.frame_url, frame_records([ {addr: 0xffff, registers: registers} ]), function(jqXHR) {
+		ok( jqXHR.status == 404, "Unknown controller rejected");
+	});
+});
+
+test("Current limits of a frame are clamped to the highest calibrated current", function() {
+	var controller = this.controller;
+	var registers = [];
+	for (var i = 0; i < 16; i++) {
+		registers.push(0);
+	}
+	registers.push(255, 255, 255, 255, 0, controller.brightness);
+	frame_test(this.frame_url, frame_records([ {addr: controller.addr, registers: registers} ]), function(jqXHR) {
+		ok( jqXHR.status == 204, "Frame applied");
+	});
+	api_test(controller.uri, 'GET', null, false, function(json, jqXHR) {
+		ok( json.leds[0].current_limit <= 500, "Current limit clamped");
+	});
+});
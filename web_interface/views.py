@@ -7,10 +7,17 @@ import gevent
 import gevent.monkey
 from gevent.queue import Queue
 from gevent.pywsgi import WSGIServer
-gevent.monkey.patch_all()
+# keep native threads, the I2C executor of the coordinator has to run in a
+# real thread so that blocking bus transfers don't stall the request handlers
+gevent.monkey.patch_all(thread=False)
 
 import threading
 
+try:
+	from geventwebsocket.handler import WebSocketHandler
+except ImportError:
+	WebSocketHandler = None
+
 from pprint import pprint
 
 from web_interface import app
@@ -22,6 +29,8 @@ from flask.ext.jsonpify import jsonify
 
 from i2c_raspberry import *
 
+import live
+
 
 @app.route('/index')
 @app.route('/')
@@ -72,6 +81,49 @@ def add_led_set_uri(led_set):
 		new_led_set[key] = led_set[key]
 	return new_led_set
 
+''' The serialized responses of the listings for the current state version of
+the coordinator. A listing is only serialized when the state changed, a
+client that sends the ETag of the current version gets 304 without any
+serialization. The mimetype is kept with the body, JSONP responses are
+JavaScript. Responses that contain writes in progress (a 'synced' flag that
+is about to change) are not cached. '''
+class ResponseCache(object):
+	def __init__(self):
+		self.entries = {}
+
+	def get(self, key, version):
+		entry = self.entries.get(key)
+		if entry is not None and entry[0] == version:
+			return entry[1:]
+		return None
+
+	def put(self, key, version, body, mimetype):
+		self.entries[key] = (version, body, mimetype)
+
+response_cache = ResponseCache()
+
+''' respond with the listing name, build_listing is called if the cached
+response is outdated '''
+def cached_listing(name, version, build_listing, cacheable=True):
+	# JSONP responses differ by callback
+	key = (name, request.args.get('callback'))
+	tag = '%s-%d' % (name, version)
+	cached = response_cache.get(key, version)
+	if cached is not None and request.if_none_match.contains(tag):
+		response = Response(status=304)
+	elif cached is not None:
+		body, mimetype = cached
+		response = Response(body, mimetype=mimetype)
+	else:
+		response = build_listing()
+		if not cacheable:
+			return response
+		response_cache.put(key, version, response.data, response.mimetype)
+	response.set_etag(tag)
+	# revalidate on every request, the state may change at any time
+	response.headers['Cache-Control'] = 'no-cache'
+	return response
+
 ''' RESTful API for accessing the state of RGB controllers '''
 class ControllerAPI(MethodView):
 	def __init__(self):
@@ -81,10 +133,9 @@ class ControllerAPI(MethodView):
 
 	def get(self, controller_address):
 		if controller_address is None:
-			controllers = []
-			for controller in self.coordinator.get_controllers():
-				controllers.append(add_controller_uri(controller))
-			return jsonify( {'controller': controllers} )
+			version = self.coordinator.version
+			return cached_listing('controller', version, self.get_controllers,
+					self.coordinator.synced())
 		else:
 			try:
 				controller = self.coordinator.get_controller(controller_address)
@@ -92,6 +143,12 @@ class ControllerAPI(MethodView):
 			except HttpError as e:
 				abort(e.error_code)
 
+	def get_controllers(self):
+		controllers = []
+		for controller in self.coordinator.get_controllers():
+			controllers.append(add_controller_uri(controller))
+		return jsonify( {'controller': controllers} )
+
 	def put(self, controller_address):
 		try:
 			self.coordinator.update_controller(request.get_json(), controller_address)
@@ -100,6 +157,15 @@ class ControllerAPI(MethodView):
 			print(e)
 			abort(e.error_code)
 
+	''' change only the given fields, returns the changed fields '''
+	def patch(self, controller_address):
+		try:
+			delta = self.coordinator.patch_controller(request.get_json(), controller_address)
+			return jsonify(add_controller_uri(delta))
+		except HttpError as e:
+			print(e)
+			abort(e.error_code)
+
 
 ''' Register the routes for the RESTful Controller API '''
 controller_view = ControllerAPI.as_view('controller_api')
@@ -108,7 +174,31 @@ app.add_url_rule('/controller', defaults = {'controller_address': None},
 app.add_url_rule('/controller/<int:controller_address>',
 		view_func=controller_view, methods=['GET',])
 app.add_url_rule('/controller/<int:controller_address>',
-		view_func=controller_view, methods=['PUT',])
+		view_func=controller_view, methods=['PUT', 'PATCH'])
+
+''' RESTful API for the cached status of the RGB controllers, served without
+accessing the I2C bus '''
+class ControllerStatusAPI(MethodView):
+	def __init__(self):
+		global coordinator
+		self.coordinator = coordinator
+		super(ControllerStatusAPI, self).__init__()
+
+	def get(self, controller_address):
+		if controller_address is None:
+			return jsonify( {'status': self.coordinator.get_controller_statuses()} )
+		else:
+			try:
+				return jsonify(self.coordinator.get_controller_status(controller_address))
+			except HttpError as e:
+				abort(e.error_code)
+
+''' Register the routes for the RESTful Controller status API '''
+status_view = ControllerStatusAPI.as_view('status_api')
+app.add_url_rule('/controller/status', defaults = {'controller_address': None},
+		view_func=status_view, methods=['GET',])
+app.add_url_rule('/controller/<int:controller_address>/status',
+		view_func=status_view, methods=['GET',])
 
 class LedSetAPI(MethodView):
 	def __init__(self):
@@ -118,10 +208,8 @@ class LedSetAPI(MethodView):
 
 	def get(self, led_set_name):
 		if led_set_name is None:
-			led_sets = []
-			for led_set in self.coordinator.get_led_sets():
-				led_sets.append(add_led_set_uri(led_set))
-			return jsonify( {'led_set' : led_sets} )
+			version = self.coordinator.version
+			return cached_listing('led_set', version, self.get_led_sets)
 		else:
 			try:
 				led_set = self.coordinator.get_led_set(led_set_name)
@@ -129,6 +217,12 @@ class LedSetAPI(MethodView):
 			except HttpError as e:
 				abort(e.error_code)
 
+	def get_led_sets(self):
+		led_sets = []
+		for led_set in self.coordinator.get_led_sets():
+			led_sets.append(add_led_set_uri(led_set))
+		return jsonify( {'led_set' : led_sets} )
+
 	def post(self, led_set_name):
 		try:
 			led_set_json = request.get_json()
@@ -147,6 +241,15 @@ class LedSetAPI(MethodView):
 			print(e)
 			abort(e.error_code)
 
+	''' change only the given fields, returns the changed fields '''
+	def patch(self, led_set_name):
+		try:
+			delta = self.coordinator.patch_led_set(request.get_json(), led_set_name)
+			return jsonify( add_led_set_uri(delta) )
+		except HttpError as e:
+			print(e)
+			abort(e.error_code)
+
 	def delete(self, led_set_name):
 		try:
 			self.coordinator.remove_led_set(led_set_name)
@@ -159,13 +262,150 @@ class LedSetAPI(MethodView):
 led_set_view = LedSetAPI.as_view('set_api')
 app.add_url_rule('/led_set', defaults = {'led_set_name': None},
 		view_func=led_set_view, methods=['GET', 'POST'])
-app.add_url_rule('/led_set/<led_set_name>', view_func=led_set_view, methods=['GET','PUT', 'DELETE'])
+app.add_url_rule('/led_set/<led_set_name>', view_func=led_set_view,
+		methods=['GET','PUT', 'PATCH', 'DELETE'])
+
+''' RESTful API for starting, parametrizing and stopping the effect of a
+LED-Set, the effect is computed by the coordinator for every frame '''
+class EffectAPI(MethodView):
+	def __init__(self):
+		global coordinator
+		self.coordinator = coordinator
+		super(EffectAPI, self).__init__()
+
+	def get(self, led_set_name):
+		if led_set_name is None:
+			return jsonify( {'effects': get_effects()} )
+		try:
+			return jsonify(self.coordinator.get_effect(led_set_name))
+		except HttpError as e:
+			abort(e.error_code)
+
+	def put(self, led_set_name):
+		try:
+			effect = self.coordinator.start_effect(led_set_name, request.get_json())
+			return jsonify(effect)
+		except HttpError as e:
+			print(e)
+			abort(e.error_code)
+
+	def delete(self, led_set_name):
+		try:
+			self.coordinator.stop_effect(led_set_name)
+			return make_response(jsonify( { "status":"effect stopped"} ), 204)
+		except HttpError as e:
+			print(e)
+			abort(e.error_code)
+
+''' Register the routes for the RESTful Effect API '''
+effect_view = EffectAPI.as_view('effect_api')
+app.add_url_rule('/effects', defaults = {'led_set_name': None},
+		view_func=effect_view, methods=['GET',])
+app.add_url_rule('/led_set/<led_set_name>/effect', view_func=effect_view,
+		methods=['GET', 'PUT', 'DELETE'])
+
+''' RESTful API for the changes of the controllers, LEDs and LED-Sets since a
+state version (?since=N, the version of the last response), so clients stay
+in sync without fetching the complete state. If resync is set, the changes
+since N are no longer known and the listings have to be fetched '''
+class ChangeAPI(MethodView):
+	def __init__(self):
+		global coordinator
+		self.coordinator = coordinator
+		super(ChangeAPI, self).__init__()
+
+	def get(self):
+		since = request.args.get('since', 0, type=int)
+		changes = self.coordinator.get_changes(since)
+		if not changes['resync']:
+			changes['controller'] = [add_controller_uri(controller)
+					for controller in changes['controller']]
+			changes['led_set'] = [add_led_set_uri(led_set) for led_set in changes['led_set']]
+		return jsonify(changes)
+
+''' Register the route for the RESTful Change API '''
+change_view = ChangeAPI.as_view('change_api')
+app.add_url_rule('/changes', view_func=change_view, methods=['GET',])
+
+''' RESTful API for applying changes of several controllers and LED-Sets at
+once: all changes are applied or none of them, the LED-Sets are stored once
+and the changes are written with a single frame '''
+class BatchAPI(MethodView):
+	def __init__(self):
+		global coordinator
+		self.coordinator = coordinator
+		super(BatchAPI, self).__init__()
+
+	def post(self):
+		try:
+			changes_json = request.get_json()
+			results = self.coordinator.apply_changes(changes_json)
+			for idx, result in enumerate(results):
+				if result is None:
+					continue
+				if 'controller' in changes_json['changes'][idx]:
+					results[idx] = add_controller_uri(result)
+				else:
+					results[idx] = add_led_set_uri(result)
+			return jsonify( {'results': results} )
+		except HttpError as e:
+			print(e)
+			abort(e.error_code)
+
+''' Register the route for the RESTful Batch API '''
+batch_view = BatchAPI.as_view('batch_api')
+app.add_url_rule('/batch', view_func=batch_view, methods=['POST',])
+
+''' API for binary frames (application/octet-stream): the registers of
+controllers as records of their addr and register block (see
+FRAME_RECORD_SIZE), copied into the state without parsing JSON. For clients
+that drive the complete installation from scripts '''
+class FrameAPI(MethodView):
+	def __init__(self):
+		global coordinator
+		self.coordinator = coordinator
+		super(FrameAPI, self).__init__()
+
+	def post(self):
+		try:
+			self.coordinator.ingest_frame(request.get_data())
+			return make_response(jsonify( {"status":"frame applied"} ), 204)
+		except HttpError as e:
+			print(e)
+			abort(e.error_code)
+
+''' Register the route for the binary frame API '''
+frame_view = FrameAPI.as_view('frame_api')
+app.add_url_rule('/frame', view_func=frame_view, methods=['POST',])
+
+''' The live channel: a WebSocket on which the client streams compact updates
+(see live.apply_message) and the changes of the installation are pushed to
+all clients. Without WebSocket support the changes are sent as server-sent
+events. The hub is created with the first client. '''
+live_hub = None
+
+@app.route('/live')
+def live_channel():
+	global live_hub
+	if live_hub is None:
+		live_hub = live.LiveHub(coordinator)
+	websocket = request.environ.get('wsgi.websocket')
+	if websocket is not None:
+		live.serve_websocket(live_hub, websocket)
+		return Response()
+	return Response(live.event_stream(live_hub), mimetype='text/event-stream',
+			headers={'Cache-Control': 'no-cache'})
 
 
 def launch_gevent_server(backend):
 	global coordinator
 	coordinator = backend
-	http_server = WSGIServer(('0.0.0.0', 5000), app)
+	# the WebSocket handler is optional (gevent-websocket), the live channel
+	# falls back to server-sent events
+	if WebSocketHandler is not None:
+		http_server = WSGIServer(('0.0.0.0', 5000), app, handler_class=WebSocketHandler)
+	else:
+		http_server = WSGIServer(('0.0.0.0', 5000), app)
 	try:
 		http_server.serve_forever()
 	except KeyboardInterrupt:
@@ -184,6 +424,7 @@ class Frontend(threading.Thread):
 		self.backend = backend
 		super(Frontend, self).__init__()
 
+	# the gevent server handles the long lived connections of the live channel
 	def run(self):
-		launch_flask_server(self.backend)
+		launch_gevent_server(self.backend)
 